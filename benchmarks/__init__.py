@@ -0,0 +1,172 @@
+"""
+Repeatable performance benchmarks for ruterstop.
+
+Benchmarks are registered with the `benchmark` decorator. A registered
+function does its setup and returns a zero-argument callable, which is the
+only thing that is timed.
+
+Run with `python -m benchmarks --help`.
+"""
+
+import json
+import platform
+import statistics
+import sys
+import time
+from collections import OrderedDict, namedtuple
+
+BENCHMARKS = OrderedDict()
+TARGETS = {}
+
+Result = namedtuple("Result", ["name", "number", "repeat", "min", "median", "max"])
+
+# A benchmark that raised instead of finishing
+Failure = namedtuple("Failure", ["name", "error"])
+
+
+def benchmark(name, *, target=None):
+    """
+    Register a benchmark setup function under `name`, optionally with a
+    target median time in seconds.
+    """
+
+    def decorator(func):
+        if name in BENCHMARKS:
+            raise ValueError("duplicate benchmark name: " + name)
+        BENCHMARKS[name] = func
+        if target is not None:
+            TARGETS[name] = target
+        return func
+
+    return decorator
+
+
+def _autorange(func, *, min_time, timer):
+    """Find a loop count that takes at least `min_time` seconds, like timeit"""
+    number = 1
+    while True:
+        start = timer()
+        for _ in range(number):
+            func()
+        elapsed = timer() - start
+        if elapsed >= min_time:
+            return number
+        number *= 10 if elapsed < min_time / 10 else 2
+
+
+def measure(name, func, *, repeat=5, min_time=0.2, timer=time.perf_counter):
+    """
+    Time `func` and return a Result with seconds per call for the fastest,
+    median and slowest of `repeat` rounds.
+    """
+    number = _autorange(func, min_time=min_time, timer=timer)
+    timings = []
+    for _ in range(repeat):
+        start = timer()
+        for _ in range(number):
+            func()
+        timings.append((timer() - start) / number)
+    return Result(
+        name=name,
+        number=number,
+        repeat=repeat,
+        min=min(timings),
+        median=statistics.median(timings),
+        max=max(timings),
+    )
+
+
+def run(*, selected=None, repeat=5, min_time=0.2):
+    """
+    Run all benchmarks whose name contains one of `selected`. Yields a
+    Result for each, or a Failure if its setup or a call raised, so one
+    broken benchmark doesn't stop the rest.
+    """
+    for name, setup in BENCHMARKS.items():
+        if selected and not any(s in name for s in selected):
+            continue
+        func = None
+        try:
+            func = setup()
+            result = measure(name, func, repeat=repeat, min_time=min_time)
+        except Exception as e:  # pylint: disable=broad-except
+            result = Failure(name, "{}: {}".format(type(e).__name__, e))
+        finally:
+            close = getattr(func, "close", None)
+            if close:
+                close()
+        yield result
+
+
+def metadata():
+    import ruterstop
+
+    return dict(
+        python=platform.python_version(),
+        implementation=platform.python_implementation(),
+        platform=platform.platform(),
+        ruterstop=ruterstop.__version__,
+        timestamp=int(time.time()),
+    )
+
+
+def dump(results, fp):
+    """Write results to a file object as JSON"""
+    doc = dict(
+        meta=metadata(),
+        results=OrderedDict((r.name, r._asdict()) for r in results),
+    )
+    json.dump(doc, fp, indent=2)
+    fp.write("\n")
+
+
+def load(fp):
+    """Read results written by `dump` and return a dict of Result by name"""
+    doc = json.load(fp)
+    return OrderedDict((k, Result(**v)) for k, v in doc["results"].items())
+
+
+Comparison = namedtuple("Comparison", ["name", "baseline", "current", "ratio"])
+
+
+def compare(baseline, current, *, threshold=0.25):
+    """
+    Compare median timings of two result dicts.
+
+    Returns a tuple of (all comparisons, regressions) where a regression is a
+    benchmark whose median is more than `threshold` slower than the baseline.
+    """
+    comparisons = []
+    for name, cur in current.items():
+        base = baseline.get(name)
+        if base is None or base.median <= 0:
+            continue
+        comparisons.append(
+            Comparison(name, base.median, cur.median, cur.median / base.median)
+        )
+    regressions = [c for c in comparisons if c.ratio > 1 + threshold]
+    return comparisons, regressions
+
+
+def missed_targets(results):
+    """Return the results with a median slower than their target"""
+    return [r for r in results if r.name in TARGETS and r.median > TARGETS[r.name]]
+
+
+def format_seconds(secs):
+    for unit, scale in (("s", 1), ("ms", 1e3), ("us", 1e6)):
+        if secs * scale >= 1:
+            return "{:.2f} {}".format(secs * scale, unit)
+    return "{:.0f} ns".format(secs * 1e9)
+
+
+def print_result(result, file=sys.stdout):
+    print(
+        "{:40}{:>12}{:>12}{:>12}".format(
+            result.name,
+            format_seconds(result.min),
+            format_seconds(result.median),
+            format_seconds(result.max),
+        ),
+        file=file,
+    )
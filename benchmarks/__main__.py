@@ -0,0 +1,104 @@
+import argparse
+import logging
+import sys
+
+import benchmarks
+import benchmarks.micro  # noqa: F401 (registers benchmarks)
+import benchmarks.serve  # noqa: F401 (registers benchmarks)
+import benchmarks.startup  # noqa: F401 (registers benchmarks)
+
+
+def main(argv=sys.argv, *, stdout=sys.stdout):
+    par = argparse.ArgumentParser(prog="python -m benchmarks")
+    par.add_argument(
+        "-k",
+        dest="selected",
+        action="append",
+        metavar="<substring>",
+        help="only run benchmarks with names containing this (repeatable)",
+    )
+    par.add_argument(
+        "--output", metavar="<file>", help="write results as JSON to this file"
+    )
+    par.add_argument(
+        "--compare",
+        metavar="<file>",
+        help="compare results with a baseline file written by --output",
+    )
+    par.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        metavar="<ratio>",
+        help="flag benchmarks slower than the baseline by more than this ratio",
+    )
+    par.add_argument("--repeat", type=int, default=5, metavar="<n>")
+    par.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        metavar="<seconds>",
+        help="minimum time of each timing round",
+    )
+    par.add_argument("--list", action="store_true", help="list benchmark names")
+    args = par.parse_args(argv[1:])
+
+    # Keep the server from logging every request
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.list:
+        for name in benchmarks.BENCHMARKS:
+            print(name, file=stdout)
+        return 0
+
+    print("{:40}{:>12}{:>12}{:>12}".format("", "min", "median", "max"), file=stdout)
+    results = []
+    failures = []
+    for result in benchmarks.run(
+        selected=args.selected, repeat=args.repeat, min_time=args.min_time
+    ):
+        if isinstance(result, benchmarks.Failure):
+            print("{:40} FAILED ({})".format(result.name, result.error), file=stdout)
+            failures.append(result)
+            continue
+        benchmarks.print_result(result, file=stdout)
+        results.append(result)
+
+    status = 1 if failures else 0
+    missed = benchmarks.missed_targets(results)
+    if missed:
+        print(file=stdout)
+    for r in missed:
+        print(
+            "{:40}{:>12} TARGET MISSED ({})".format(
+                r.name,
+                benchmarks.format_seconds(r.median),
+                benchmarks.format_seconds(benchmarks.TARGETS[r.name]),
+            ),
+            file=stdout,
+        )
+        status = 1
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            benchmarks.dump(results, fp)
+
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = benchmarks.load(fp)
+        current = {r.name: r for r in results}
+        comparisons, regressions = benchmarks.compare(
+            baseline, current, threshold=args.threshold
+        )
+        print(file=stdout)
+        for c in comparisons:
+            flag = "REGRESSION" if c in regressions else ""
+            print("{:40}{:>11.2f}x {}".format(c.name, c.ratio, flag), file=stdout)
+        if regressions:
+            status = 1
+
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
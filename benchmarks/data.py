@@ -0,0 +1,31 @@
+"""
+Input data for benchmarks: the unit test fixtures and synthetic payloads
+shaped like EnTur JourneyPlanner responses.
+"""
+
+import json
+import os
+
+from ruterstop import fakeentur
+
+FIXTURE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "ruterstop", "tests"
+)
+
+# Destination names, with Norwegian characters for norwegian_ascii
+DESTINATIONS = [name for pair in fakeentur.DESTINATIONS for name in pair]
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURE_DIR, name)) as fp:
+        return json.load(fp)
+
+
+def synthetic_payload(count, *, stop_id=6013, seed=0):
+    """Return a JourneyPlanner response with `count` departures from now"""
+    return fakeentur.synthetic_departures(stop_id, count, seed=seed)
+
+
+def fixture_payload_now():
+    """Return test_data.json with departures shifted to start now"""
+    return fakeentur.shift_departures(load_fixture("test_data.json"))
@@ -0,0 +1,144 @@
+"""
+Microbenchmarks for parsing, filtering and formatting departures.
+"""
+
+from datetime import datetime, timedelta
+
+import ruterstop
+from ruterstop.batch import format_departure_lists
+from ruterstop.utils import human_delta, norwegian_ascii, timed_cache
+
+from benchmarks import benchmark
+from benchmarks.data import (
+    DESTINATIONS,
+    fixture_payload_now,
+    load_fixture,
+    synthetic_payload,
+)
+
+
+@benchmark("parse_departures[fixture]")
+def bench_parse_fixture():
+    data = load_fixture("test_data.json")
+    return lambda: list(ruterstop.parse_departures(data))
+
+
+@benchmark("parse_departures[1000]")
+def bench_parse_large():
+    data = synthetic_payload(1000)
+    return lambda: list(ruterstop.parse_departures(data))
+
+
+@benchmark("parse_stops[fixture]")
+def bench_parse_stops():
+    data = load_fixture("test_stop_data.json")
+    return lambda: list(ruterstop.parse_stops(data))
+
+
+@benchmark("format_departure_list[fixture]")
+def bench_format_fixture():
+    deps = list(ruterstop.parse_departures(fixture_payload_now()))
+    return lambda: ruterstop.format_departure_list(deps)
+
+
+@benchmark("format_departure_list[fixture,grouped]")
+def bench_format_fixture_grouped():
+    deps = list(ruterstop.parse_departures(fixture_payload_now()))
+    return lambda: ruterstop.format_departure_list(
+        deps, directions="inbound", grouped=True
+    )
+
+
+@benchmark("format_departure_list[1000]")
+def bench_format_large():
+    deps = list(ruterstop.parse_departures(synthetic_payload(1000)))
+    return lambda: ruterstop.format_departure_list(deps, min_eta=2, long_eta=30)
+
+
+@benchmark("format_departure_list[1000,grouped]")
+def bench_format_large_grouped():
+    deps = list(ruterstop.parse_departures(synthetic_payload(1000)))
+    return lambda: ruterstop.format_departure_list(
+        deps, directions="outbound", grouped=True
+    )
+
+
+@benchmark("format_departure_list[1000,request now]")
+def bench_format_large_request_now():
+    deps = list(ruterstop.parse_departures(synthetic_payload(1000)))
+    now = datetime.now()
+    return lambda: ruterstop.format_departure_list(
+        deps, min_eta=2, long_eta=30, now=now
+    )
+
+
+# Display options of the boards in the batch rendering benchmarks
+BOARD_OPTIONS = [
+    dict(),
+    dict(directions="outbound"),
+    dict(min_eta=2, long_eta=30),
+    dict(directions="inbound", grouped=True),
+    dict(long_eta=-1),
+]
+
+
+def board_jobs(count, *, stops=100):
+    """`count` boards showing 20 departures each from one of `stops` stops"""
+    departures = [
+        list(ruterstop.parse_departures(synthetic_payload(20, stop_id=s)))
+        for s in range(6000, 6000 + stops)
+    ]
+    return [
+        (departures[i % stops], BOARD_OPTIONS[i % len(BOARD_OPTIONS)])
+        for i in range(count)
+    ]
+
+
+@benchmark("render[10k boards,format_departure_list]")
+def bench_render_one_by_one():
+    jobs = board_jobs(10000)
+    return lambda: [ruterstop.format_departure_list(d, **o) for d, o in jobs]
+
+
+@benchmark("render[10k boards,batch]", target=0.25)
+def bench_render_batch():
+    jobs = board_jobs(10000)
+    return lambda: format_departure_lists(jobs)
+
+
+@benchmark("timed_cache[hit x1000]")
+def bench_timed_cache_hit():
+    @timed_cache(expires_sec=3600)
+    def fetch(*, stop_id):
+        return stop_id
+
+    stop_ids = list(range(6000, 6100)) * 10
+
+    def run():
+        for stop_id in stop_ids:
+            fetch(stop_id=stop_id)
+
+    return run
+
+
+@benchmark("human_delta[x100]")
+def bench_human_delta():
+    ref = datetime.now()
+    etas = [ref + timedelta(seconds=37 * i) for i in range(100)]
+
+    def run():
+        for eta in etas:
+            human_delta(until=eta, since=ref)
+
+    return run
+
+
+@benchmark("norwegian_ascii[x100]")
+def bench_norwegian_ascii():
+    names = DESTINATIONS * 10
+
+    def run():
+        for name in names:
+            norwegian_ascii(name)
+
+    return run
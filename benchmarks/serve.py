@@ -0,0 +1,104 @@
+"""
+End-to-end benchmarks of the HTTP server against a local fake EnTur API.
+"""
+
+import itertools
+import threading
+import urllib.request
+from io import BytesIO
+from wsgiref.simple_server import make_server
+from wsgiref.util import setup_testing_defaults
+
+import ruterstop
+from ruterstop.fakeentur import (
+    JOURNEY_PLANNER_PATH,
+    FakeEnTur,
+    QuietHandler,
+    make_fake_server,
+)
+
+from benchmarks import benchmark
+from benchmarks.data import synthetic_payload
+
+
+class BackgroundServer:
+    """Serve a WSGI server in a daemon thread"""
+
+    def __init__(self, httpd):
+        self.httpd = httpd
+        self.url = "http://127.0.0.1:{}".format(httpd.server_port)
+        self.thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class ServeBenchmark:
+    """
+    Starts a fake EnTur upstream and the ruterstop webapp, and requests paths
+    from `paths` over HTTP on every call.
+    """
+
+    def __init__(self, paths, *, departures=20, latency="0"):
+        self.fake = FakeEnTur(departures=departures, latency=latency)
+        self.upstream = BackgroundServer(make_fake_server(self.fake))
+        self.original_endpoint = ruterstop.ENTUR_GRAPHQL_ENDPOINT
+        ruterstop.ENTUR_GRAPHQL_ENDPOINT = self.upstream.url + JOURNEY_PLANNER_PATH
+        self.server = BackgroundServer(
+            make_server("127.0.0.1", 0, ruterstop.webapp, handler_class=QuietHandler)
+        )
+        self.paths = paths
+
+    def __call__(self):
+        url = self.server.url + next(self.paths)
+        with urllib.request.urlopen(url) as res:
+            res.read()
+
+    def close(self):
+        self.server.close()
+        self.upstream.close()
+        ruterstop.ENTUR_GRAPHQL_ENDPOINT = self.original_endpoint
+
+
+@benchmark("serve[http,cached]")
+def bench_serve_cached():
+    return ServeBenchmark(itertools.repeat("/6013?min_eta=1&long_eta=30"))
+
+
+@benchmark("serve[http,uncached]")
+def bench_serve_uncached():
+    # A new stop for every request misses the cache and calls upstream
+    return ServeBenchmark("/{}".format(i) for i in itertools.count(100000))
+
+
+@benchmark("serve[http,uncached,3 stops,20ms upstream]")
+def bench_serve_merged_uncached():
+    # Concurrent fetches should keep this close to a single 20 ms fetch
+    paths = ("/{},{},{}".format(i, i + 1, i + 2) for i in itertools.count(200000, 3))
+    return ServeBenchmark(paths, latency="20")
+
+
+@benchmark("serve[wsgi,cached,200]")
+def bench_serve_wsgi():
+    """The webapp called directly, without sockets or an upstream"""
+    deps = list(ruterstop.parse_departures(synthetic_payload(200)))
+    original = ruterstop.get_departures
+    ruterstop.get_departures = lambda *, stop_id=None, now=None: iter(deps)
+
+    def start_response(status, headers, exc_info=None):
+        if not status.startswith("200"):
+            raise RuntimeError("webapp responded " + status)
+
+    def run():
+        environ = dict(PATH_INFO="/6013", QUERY_STRING="grouped=1&direction=inbound")
+        environ["wsgi.input"] = BytesIO()
+        setup_testing_defaults(environ)
+        b"".join(ruterstop.webapp(environ, start_response))
+
+    def close():
+        ruterstop.get_departures = original
+
+    run.close = close
+    return run
@@ -0,0 +1,79 @@
+"""
+Process startup benchmarks for one-shot CLI invocations.
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+
+import ruterstop
+from ruterstop.diskcache import DiskCache
+
+from benchmarks import benchmark
+from benchmarks.data import synthetic_payload
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Target median wall time of `ruterstop --stop-id X --disk-cache` on a cache
+# hit, including interpreter startup
+CACHED_CLI_TARGET_SEC = 0.15
+
+# Fail instead of reaching the real API if a run misses the cache
+OFFLINE_ENV = dict(
+    os.environ,
+    RUTERSTOP_ENTUR_GRAPHQL_ENDPOINT="http://127.0.0.1:9/",
+    RUTERSTOP_ENTUR_STOP_PLACE_ENDPOINT="http://127.0.0.1:9/",
+)
+
+
+def python(*args, **kwargs):
+    """Return a function running the interpreter with `args`"""
+    cmd = [sys.executable] + list(args)
+
+    def run():
+        subprocess.run(
+            cmd,
+            check=True,
+            cwd=ROOT,
+            env=OFFLINE_ENV,
+            stdout=subprocess.DEVNULL,
+            **kwargs
+        )
+
+    return run
+
+
+@benchmark("startup[python]")
+def bench_python():
+    """Bare interpreter startup, for reference"""
+    return python("-c", "pass")
+
+
+@benchmark("startup[import]")
+def bench_import():
+    return python("-c", "import ruterstop")
+
+
+@benchmark("startup[cli,disk-cached]", target=CACHED_CLI_TARGET_SEC)
+def bench_cli_cached():
+    tmp = tempfile.TemporaryDirectory()
+    cache = DiskCache(tmp.name, ttl=ruterstop.REALTIME_CACHE_SEC)
+    payload = synthetic_payload(20)
+    cli = python(
+        "-m",
+        "ruterstop",
+        "--stop-id",
+        "6013",
+        "--disk-cache",
+        "--cache-dir",
+        tmp.name,
+    )
+
+    def run():
+        # Keep the entry fresh through long runs
+        cache.write("stop-6013-{}".format(ruterstop.REALTIME_TIME_RANGE_SEC), payload)
+        cli()
+
+    run.close = tmp.cleanup
+    return run
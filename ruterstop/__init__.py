@@ -4,20 +4,21 @@ Get realtime stop information for a specific public transport station in Oslo,
 Norway. Data is requested from the EnTur JourneyPlanner API.
 
 - API calls are cached to reduce load in `--server` mode
+- The HTTP server and client libraries are only imported when needed, to keep
+  one-shot CLI invocations fast
 - Use `--help` for usage info.
 """
 
-import argparse
+import heapq
 import logging
 import os
-import socket
 import sys
-from collections import defaultdict, namedtuple
+from collections import OrderedDict, defaultdict, namedtuple
 from datetime import datetime, timedelta
+from itertools import islice
+from operator import attrgetter
 
-import requests
-import bottle
-
+from ruterstop import utils
 from ruterstop.utils import delta, human_delta, norwegian_ascii, timed_cache
 
 __version__ = "0.5.1"
@@ -25,8 +26,25 @@ __version__ = "0.5.1"
 # Default settings
 DEFAULTS = dict(long_eta=59)
 
+# Seconds to keep realtime stop information before requesting it again
+REALTIME_CACHE_SEC = 30
+
+# Seconds ahead to request realtime departures for, and how many
+REALTIME_TIME_RANGE_SEC = 72100
+DEPARTURE_COUNT = 20
+
+# With a --timetable, only departures in the next minutes are requested from
+# the API. Later departures are planned ones from the timetable.
+TIMETABLE_REALTIME_MIN = DEFAULTS["long_eta"]
+
+# How late a planned departure can run and still depart in the realtime window
+TIMETABLE_MAX_DELAY_MIN = 30
+
 ENTUR_CLIENT_ID = __version__
-ENTUR_STOP_PLACE_ENDPOINT = "https://api.entur.io/stop-places/v1/graphql"
+ENTUR_STOP_PLACE_ENDPOINT = os.environ.get(
+    "RUTERSTOP_ENTUR_STOP_PLACE_ENDPOINT",
+    "https://api.entur.io/stop-places/v1/graphql",
+)
 ENTUR_STOP_PLACE_QUERY = """
 {
   stopPlace(size: 250, query: "%(stop_name)s") {
@@ -47,18 +65,22 @@ ENTUR_STOP_PLACE_QUERY = """
   }
 }
 """
-ENTUR_GRAPHQL_ENDPOINT = "https://api.entur.io/journey-planner/v2/graphql"
+ENTUR_GRAPHQL_ENDPOINT = os.environ.get(
+    "RUTERSTOP_ENTUR_GRAPHQL_ENDPOINT",
+    "https://api.entur.io/journey-planner/v2/graphql",
+)
 ENTUR_GRAPHQL_QUERY = """
 {
   stopPlace(id: "NSR:StopPlace:%(stop_id)s") {
     name
-    estimatedCalls(timeRange: 72100, numberOfDepartures: 20) {
+    estimatedCalls(timeRange: %(time_range)d, numberOfDepartures: %(count)d) {
       expectedArrivalTime
       realtime
       destinationDisplay {
         frontText
       }
       serviceJourney {
+        id
         directionType
         line {
           publicCode
@@ -69,37 +91,26 @@ ENTUR_GRAPHQL_QUERY = """
 }
 """
 
-webapp = bottle.Bottle()
 log = logging.getLogger("ruterstop")
 
 
-def not_found_error_handler(res):
-    res.set_header("Content-Type", "text/plain")
-    return "Ugyldig stoppested"
-
-
-webapp.error(code=404)(not_found_error_handler)
-
-
-def default_error_handler(res):
-    res.set_header("Content-Type", "text/plain")
-    log.error(res.traceback)
-    return "Feil på serveren"
-
-
-webapp.default_error_handler = default_error_handler
-
-
 class Departure(
-    namedtuple("Departure", ["line", "name", "eta", "direction", "realtime"])
+    namedtuple("Departure", ["line", "name", "eta", "direction", "realtime", "id"])
 ):
-    """Represents a transport departure"""
+    """
+    Represents a transport departure. `id` is the ID of the service journey,
+    when known.
+    """
 
     def __str__(self):
+        return self.delta_str()
+
+    def delta_str(self, now=None):
+        """Format with the time left from `now`, or from the current time"""
         name = str(self.line)
         if self.name:
             name += " " + self.name
-        return "{:14}{:>7}".format(name[:14], human_delta(until=self.eta))
+        return "{:14}{:>7}".format(name[:14], human_delta(until=self.eta, since=now))
 
     def ts_str(self):
         name = str(self.line)
@@ -107,13 +118,56 @@ class Departure(
             name += " " + self.name
         return "{:16}{:%H:%M}".format(name[:14], self.eta)
 
+    @property
+    def planned(self):
+        """True for departures from a timetable, which have no realtime data or ID"""
+        return not self.realtime and self.id is None
+
 
 # Python < 3.7 equivalent of `defaults` kwarg of `namedtuple`
-Departure.__new__.__defaults__ = (False,)
+Departure.__new__.__defaults__ = (False, None)
+
+
+# Persistent cache shared between CLI invocations, enabled with --disk-cache
+disk_cache = None
+
+# Compiled GTFS timetable of planned departures, loaded with --timetable
+timetable = None
+
+# Nodes sharing upstream requests in --server mode, set with --cluster-nodes
+cluster = None
+
+# HTTP session reused between requests in --watch mode, to keep the
+# connection to EnTur open
+http_session = None
+
+
+def http_post(url, **kwargs):
+    """POST using the shared session if there is one"""
+    if http_session is not None:
+        return http_session.post(url, **kwargs)
+
+    import requests
+
+    return requests.post(url, **kwargs)
+
+
+@timed_cache(expires_sec=REALTIME_CACHE_SEC)
+def get_realtime_stop(*, stop_id=None, time_range=REALTIME_TIME_RANGE_SEC):
+    """
+    Return realtime stop information, from the disk cache if it is enabled
+    and holds a fresh entry for this stop.
+    """
+
+    def request():
+        return request_realtime_stop(stop_id=stop_id, time_range=time_range)
+
+    if disk_cache is None:
+        return request()
+    return disk_cache.get("stop-{}-{}".format(stop_id, time_range), request)
 
 
-@timed_cache(expires_sec=30)
-def get_realtime_stop(*, stop_id=None):
+def request_realtime_stop(*, stop_id=None, time_range=REALTIME_TIME_RANGE_SEC):
     """
     Query EnTur API for realtime stop information.
 
@@ -126,8 +180,10 @@ def get_realtime_stop(*, stop_id=None):
         "ET-Client-Name": "ruterstop - stigok/ruterstop",
         "ET-Client-Id": ENTUR_CLIENT_ID,
     }
-    qry = ENTUR_GRAPHQL_QUERY % dict(stop_id=stop_id)
-    res = requests.post(
+    qry = ENTUR_GRAPHQL_QUERY % dict(
+        stop_id=stop_id, time_range=time_range, count=DEPARTURE_COUNT
+    )
+    res = http_post(
         ENTUR_GRAPHQL_ENDPOINT,
         headers=headers,
         timeout=5,
@@ -150,7 +206,7 @@ def get_stop_search_result(*, name_search):
         "ET-Client-Id": ENTUR_CLIENT_ID,
     }
     qry = ENTUR_STOP_PLACE_QUERY % dict(stop_name=name_search)
-    res = requests.post(
+    res = http_post(
         ENTUR_STOP_PLACE_ENDPOINT,
         headers=headers,
         timeout=5,
@@ -192,40 +248,79 @@ def parse_departures(raw_dict, *, date_fmt="%Y-%m-%dT%H:%M:%S%z"):
                 eta=eta,
                 direction=dep["serviceJourney"]["directionType"],
                 realtime=dep["realtime"],
+                id=dep["serviceJourney"].get("id"),
             )
 
 
-@webapp.route("/<stop_id:int>")
-def serve_departures(stop_id):
+def get_departures(*, stop_id=None, now=None):
     """
-    Responds to web requests by turning whitelisted querystring values into
-    kwargs passed on to format_departure_list.
+    Returns a list of Departure objects. `now` is the time of the request,
+    which planned departures from a timetable are picked by.
+
+    Upstream API calls are cached, so it can be called repeatedly.
     """
-    q = bottle.request.query
-    kw = dict()
+    if timetable is not None and stop_id in timetable:
+        return get_timetable_departures(stop_id=stop_id, now=now)
 
-    if q.direction:
-        kw["directions"] = q.direction
-    if q.min_eta:
-        kw["min_eta"] = int(q.min_eta)
-    if q.grouped:
-        kw["grouped"] = True
-    if q.long_eta:
-        kw["long_eta"] = int(q.long_eta)
+    if cluster is not None:
+        raw_stop = cluster.get_stop(stop_id, time_range=REALTIME_TIME_RANGE_SEC)
+    else:
+        raw_stop = get_realtime_stop(stop_id=stop_id)
+    return parse_departures(raw_stop)
 
-    deps = get_departures(stop_id=stop_id)
-    bottle.response.set_header("Content-Type", "text/plain")
-    return format_departure_list(deps, **kw)
 
+def get_timetable_departures(*, stop_id=None, now=None):
+    """
+    Returns planned departures from the timetable, merged with realtime
+    departures for the next TIMETABLE_REALTIME_MIN minutes.
 
-def get_departures(*, stop_id=None):
+    The API is only called when the timetable has departures that could be
+    leaving within the realtime window.
     """
-    Returns a list of Departure objects.
+    now = now or utils.now()
+    window_end = now + timedelta(minutes=TIMETABLE_REALTIME_MIN)
+    planned = timetable.departures(
+        stop_id,
+        since=window_end,
+        until=now + timedelta(seconds=REALTIME_TIME_RANGE_SEC),
+        count=DEPARTURE_COUNT,
+    )
 
-    Upstream API calls are cached, so it can be called repeatedly.
+    near_term = timetable.departures(
+        stop_id,
+        since=now - timedelta(minutes=TIMETABLE_MAX_DELAY_MIN),
+        until=window_end,
+        count=1,
+    )
+    if not near_term:
+        return iter(planned)
+
+    time_range = TIMETABLE_REALTIME_MIN * 60
+    if cluster is not None:
+        raw_stop = cluster.get_stop(stop_id, time_range=time_range)
+    else:
+        raw_stop = get_realtime_stop(stop_id=stop_id, time_range=time_range)
+    deps = heapq.merge(parse_departures(raw_stop), planned, key=attrgetter("eta"))
+    return islice(deps, DEPARTURE_COUNT)
+
+
+def get_merged_departures(*, stop_ids, now=None):
     """
-    raw_stop = get_realtime_stop(stop_id=stop_id)
-    return parse_departures(raw_stop)
+    Returns Departure objects from several stops, merged in order of ETA.
+
+    Stops are fetched concurrently, so a board of uncached stops takes about
+    as long as the slowest single fetch. Each stop's departures are already
+    sorted, so they are merged lazily instead of sorted again.
+    """
+    stop_ids = list(OrderedDict.fromkeys(stop_ids))
+    if len(stop_ids) == 1:
+        return get_departures(stop_id=stop_ids[0], now=now)
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=len(stop_ids)) as pool:
+        stops = list(pool.map(lambda s: get_departures(stop_id=s, now=now), stop_ids))
+    return heapq.merge(*stops, key=attrgetter("eta"))
 
 
 def format_departure_list(
@@ -234,19 +329,23 @@ def format_departure_list(
     min_eta=0,
     long_eta=DEFAULTS["long_eta"],
     directions=None,
-    grouped=False
+    grouped=False,
+    now=None
 ):
     """
-    Filters, formats and groups departures based on arguments passed.
+    Filters, formats and groups departures based on arguments passed. ETAs
+    are counted from `now`, or from the current time.
     """
+    now = now or utils.now()
     deps = (d for d in departures)
 
-    # Filter on directions
+    # Filter on directions. Without a filter, planned departures are shown in
+    # any direction, as timetables may not know the direction of a trip.
     dirs = ["inbound", "outbound"] if not directions else directions
-    deps = filter(lambda d: d.direction in dirs, deps)
+    deps = filter(lambda d: d.direction in dirs or not directions and d.planned, deps)
 
     # Filter departures with minimum time treshold
-    time_treshold = datetime.now() + timedelta(minutes=min_eta)
+    time_treshold = now + timedelta(minutes=min_eta)
     deps = filter(
         lambda d: d.eta >= time_treshold or (min_eta == 0 and d.realtime), deps
     )
@@ -257,7 +356,7 @@ def format_departure_list(
         # Group by ETA value
         by_eta = defaultdict(list)
         for dep in deps:
-            by_eta[human_delta(dep.eta)].append(dep)
+            by_eta[human_delta(dep.eta, since=now)].append(dep)
 
         # Build string output
         newdeps = list()
@@ -280,15 +379,17 @@ def format_departure_list(
     # Create pretty output
     s = ""
     for dep in deps:
-        if 0 < long_eta < delta(dep.eta):
+        if 0 < long_eta < delta(dep.eta, since=now):
             s += dep.ts_str() + "\n"
         else:
-            s += str(dep) + "\n"
+            s += dep.delta_str(now) + "\n"
     return s
 
 
 def main(argv=sys.argv, *, stdout=sys.stdout):
     """Main function for CLI usage"""
+    import argparse
+
     # Parse command line arguments
     par = argparse.ArgumentParser(prog="ruterstop")
     par.add_argument(
@@ -296,8 +397,8 @@ def main(argv=sys.argv, *, stdout=sys.stdout):
     )
     par.add_argument(
         "--stop-id",
-        metavar="<id>",
-        help="use --search-stop or official website to find stops https://stoppested.entur.org (guest:guest)",
+        metavar="<id[,id...]>",
+        help="comma separated list of stops to show. use --search-stop or official website to find stops https://stoppested.entur.org (guest:guest)",
     )
     par.add_argument(
         "--direction",
@@ -323,6 +424,43 @@ def main(argv=sys.argv, *, stdout=sys.stdout):
         action="store_true",
         help="group departures with same ETA together when --direction is also specified.",
     )
+    par.add_argument(
+        "--disk-cache",
+        action="store_true",
+        help="share cached API responses between invocations for {} seconds".format(
+            REALTIME_CACHE_SEC
+        ),
+    )
+    par.add_argument(
+        "--cache-dir",
+        type=str,
+        metavar="<path>",
+        help="directory of --disk-cache (default: $XDG_CACHE_HOME/ruterstop)",
+    )
+    par.add_argument(
+        "--timetable",
+        type=str,
+        metavar="<file>",
+        help="use planned departures from a compiled timetable beyond the next {} minutes".format(
+            TIMETABLE_REALTIME_MIN
+        ),
+    )
+    par.add_argument(
+        "--import-timetable",
+        type=str,
+        metavar="<gtfs>",
+        help="compile a GTFS zip file or directory into --timetable, limited to --stop-id if given",
+    )
+    par.add_argument(
+        "--watch",
+        type=int,
+        nargs="?",
+        const=REALTIME_CACHE_SEC,
+        metavar="<seconds>",
+        help="keep showing departures, refreshing every {} seconds unless set".format(
+            REALTIME_CACHE_SEC
+        ),
+    )
     par.add_argument("--server", action="store_true", help="start a HTTP server")
     par.add_argument(
         "--host",
@@ -338,9 +476,94 @@ def main(argv=sys.argv, *, stdout=sys.stdout):
         metavar="<port>",
         help="HTTP server listen port",
     )
+    par.add_argument(
+        "--profiles",
+        type=str,
+        metavar="<file>",
+        help="serve the named display profiles in a TOML file at /p/<name>",
+    )
+    par.add_argument(
+        "--state-file",
+        type=str,
+        metavar="<path>",
+        help="save popular stops and cached departures here on server shutdown, and warm the cache from it on startup",
+    )
+    par.add_argument(
+        "--prewarm-at",
+        type=str,
+        metavar="<HH:MM[,HH:MM...]>",
+        help="warm the cache with the most popular stops of the hour ahead of these times",
+    )
+    par.add_argument(
+        "--cluster-nodes",
+        type=str,
+        metavar="<url,url...>",
+        help="base URLs of all servers in a cluster, which share upstream requests",
+    )
+    par.add_argument(
+        "--cluster-self",
+        type=str,
+        metavar="<url>",
+        help="base URL of this server in --cluster-nodes",
+    )
+    par.add_argument(
+        "--debug-token",
+        type=str,
+        default=os.environ.get("RUTERSTOP_DEBUG_TOKEN"),
+        metavar="<token>",
+        help="enable authenticated /debug profiling routes in server mode (or set RUTERSTOP_DEBUG_TOKEN)",
+    )
     par.add_argument("--debug", action="store_true", help="enable debug logging")
     par.add_argument("--version", action="store_true", help="show version information")
 
+    load = par.add_argument_group("load testing")
+    load.add_argument(
+        "--load-test",
+        type=str,
+        metavar="<url>",
+        help="send requests to a running ruterstop server and report latencies",
+    )
+    load.add_argument(
+        "--load-stops",
+        type=str,
+        default="6000-6099",
+        metavar="<spec>",
+        help="stops to request, e.g. 6013=25,6014,6000-6099 (default: %(default)s)",
+    )
+    load.add_argument(
+        "--load-popularity",
+        type=str,
+        default="zipf:1",
+        metavar="<zipf:<s>|uniform>",
+        help="popularity of stops without explicit weight, by list order (default: %(default)s)",
+    )
+    load.add_argument(
+        "--load-concurrency",
+        type=int,
+        default=4,
+        metavar="<n>",
+        help="number of concurrent connections (default: %(default)s)",
+    )
+    load.add_argument(
+        "--load-rate",
+        type=float,
+        metavar="<req/s>",
+        help="target request rate, instead of as fast as possible",
+    )
+    load.add_argument(
+        "--load-duration",
+        type=float,
+        default=10,
+        metavar="<seconds>",
+        help="how long to run (default: %(default)s)",
+    )
+    load.add_argument(
+        "--load-requests",
+        type=int,
+        metavar="<n>",
+        help="stop after this many requests",
+    )
+
     args = par.parse_args(argv[1:])
 
     if args.debug:
@@ -353,6 +576,37 @@ def main(argv=sys.argv, *, stdout=sys.stdout):
         print("ruterstop " + __version__, file=stdout)
         return
 
+    if args.disk_cache:
+        from ruterstop.diskcache import DiskCache, default_cache_dir
+
+        global disk_cache  # pylint: disable=global-statement
+        disk_cache = DiskCache(
+            args.cache_dir or default_cache_dir(), ttl=REALTIME_CACHE_SEC
+        )
+
+    # Compile a timetable?
+    if args.import_timetable:
+        if not args.timetable:
+            par.error("--timetable is required with --import-timetable")
+            return
+
+        from ruterstop.gtfs import compile_gtfs
+
+        only = [s.strip() for s in args.stop_id.split(",")] if args.stop_id else None
+        table = compile_gtfs(args.import_timetable, stop_ids=only)
+        table.save(args.timetable)
+        print(
+            "Imported {} departures from {} stops".format(len(table), len(table.stops)),
+            file=stdout,
+        )
+        return
+
+    if args.timetable:
+        from ruterstop.gtfs import Timetable
+
+        global timetable  # pylint: disable=global-statement
+        timetable = Timetable.load(args.timetable)
+
     # Search for stop?
     if args.search_stop:
         result = get_stop_search_result(name_search=args.search_stop)
@@ -361,28 +615,105 @@ def main(argv=sys.argv, *, stdout=sys.stdout):
             print(s, file=stdout)
         return
 
-    # Build direction filter list
-    directions = args.direction if args.direction else ["inbound", "outbound"]
+    # Load test a running server?
+    if args.load_test:
+        from ruterstop import loadgen
+
+        try:
+            stops = loadgen.parse_stops(
+                args.load_stops, popularity=args.load_popularity
+            )
+        except ValueError as e:
+            par.error(str(e))
+            return
+
+        gen = loadgen.LoadGenerator(
+            args.load_test,
+            stops,
+            concurrency=args.load_concurrency,
+            rate=args.load_rate,
+            duration=None if args.load_requests else args.load_duration,
+            max_requests=args.load_requests,
+        )
+        print(gen.run(), file=stdout)
+        return
+
+    # Direction filter list, or None to show the default directions
+    directions = args.direction or None
 
     if args.server:
-        # Start server
-        bottle.run(webapp, host=args.host, port=args.port)
+        from ruterstop import server
+        from ruterstop.profiles import load_profiles
+        from ruterstop.warmup import parse_times
+
+        try:
+            prewarm_at = parse_times(args.prewarm_at) if args.prewarm_at else None
+            if args.profiles:
+                server.profiles = load_profiles(args.profiles)
+            if args.cluster_nodes:
+                global cluster  # pylint: disable=global-statement
+                cluster = server.make_cluster(
+                    nodes=args.cluster_nodes.split(","), self_url=args.cluster_self
+                )
+        except (OSError, ValueError) as e:
+            par.error(str(e))
+            return
+
+        server.run(
+            host=args.host,
+            port=args.port,
+            debug_token=args.debug_token,
+            state_file=args.state_file,
+            prewarm_at=prewarm_at,
+        )
     else:
         if not args.stop_id:
             par.error("stop_id is required when not in server mode")
             return
+        stop_ids = [s.strip() for s in args.stop_id.split(",") if s.strip()]
+
+        def render(deps, now=None):
+            return format_departure_list(
+                deps,
+                min_eta=args.min_eta,
+                long_eta=args.long_eta,
+                directions=directions,
+                grouped=args.grouped,
+                now=now,
+            )
+
+        if args.watch:
+            import requests
+            from ruterstop.watch import watch
+
+            global http_session  # pylint: disable=global-statement
+            http_session = requests.Session()
+            watch(
+                lambda: get_merged_departures(stop_ids=stop_ids),
+                render,
+                stream=stdout,
+                refresh_sec=args.watch,
+            )
+            return
 
-        # Just print stop information
-        deps = get_departures(stop_id=args.stop_id)
-        formatted = format_departure_list(
-            deps,
-            min_eta=args.min_eta,
-            long_eta=args.long_eta,
-            directions=directions,
-            grouped=args.grouped,
-        )
+        # Just print stop information, as of one point in time
+        now = utils.now()
+        deps = get_merged_departures(stop_ids=stop_ids, now=now)
+        print(render(deps, now), file=stdout)
+
+
+if sys.version_info >= (3, 7):
+
+    def __getattr__(name):
+        """Import the HTTP server stack on first use of `webapp`"""
+        if name in ("webapp", "serve_departures"):
+            from ruterstop import server
+
+            return getattr(server, name)
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
 
-        print(formatted, file=stdout)
+else:  # pragma: no cover (no module __getattr__ before Python 3.7)
+    from ruterstop.server import webapp, serve_departures
 
 
 if __name__ == "__main__":
@@ -0,0 +1,125 @@
+"""
+Batch rendering of many departure boards against one reference time.
+
+`format_departure_lists` gives the same output as calling
+`format_departure_list` for each board at the same moment, but does the
+per-departure work once per batch instead of once per board:
+
+- minutes until each distinct ETA are computed once, as integers
+- ETA texts for 0-99 minutes are looked up in a precomputed table
+- each row of text is formatted once per distinct departure and ETA style
+
+This matters when the same stops are shown on many boards with different
+options, like when rendering every display profile in one tick.
+"""
+
+from datetime import timedelta
+
+import ruterstop
+from ruterstop import utils
+
+# `human_delta` padded to the width used on a board, indexed by minutes
+ETA_STRINGS = ["{:>7}".format("naa")] + [
+    "{:>7}".format("{:2} min".format(m)) for m in range(1, 100)
+]
+
+_ZERO = timedelta(0)
+
+
+class BatchRenderer:
+    """
+    Renders boards as format_departure_list would at the time `now`. Keeps
+    what it computes per departure, so reuse one renderer for all boards of
+    a batch and create a new one for the next.
+    """
+
+    def __init__(self, now=None):
+        self.now = now or utils.now()
+        self.minutes = {}
+        self.thresholds = {}
+        self.rendered = {}
+
+    def delta(self, eta):
+        """Whole minutes until `eta`, like utils.delta, or -1 if it has passed"""
+        mins = self.minutes.get(eta)
+        if mins is None:
+            td = eta - self.now
+            mins = -1 if td < _ZERO else td.seconds // 60
+            self.minutes[eta] = mins
+        return mins
+
+    def threshold(self, min_eta):
+        threshold = self.thresholds.get(min_eta)
+        if threshold is None:
+            threshold = self.now + timedelta(minutes=min_eta)
+            self.thresholds[min_eta] = threshold
+        return threshold
+
+    def format_row(self, row, mins, clock_time):
+        """Format a row like Departure.__str__, or Departure.ts_str if `clock_time`"""
+        line, name, eta = row
+        label = str(line)
+        if name:
+            label += " " + name
+        if clock_time:
+            return "{:16}{:%H:%M}\n".format(label[:14], eta)
+        return "{:14}".format(label[:14]) + ETA_STRINGS[min(max(mins, 0), 99)] + "\n"
+
+    def render(
+        self,
+        departures,
+        *,
+        min_eta=0,
+        long_eta=ruterstop.DEFAULTS["long_eta"],
+        directions=None,
+        grouped=False
+    ):
+        """Return a board, with the same arguments as format_departure_list"""
+        dirs = ["inbound", "outbound"] if not directions else directions
+        threshold = self.threshold(min_eta)
+        keep_realtime = min_eta == 0
+        deps = [
+            d
+            for d in departures
+            if (d.direction in dirs or not directions and d.planned)
+            and (d.eta >= threshold or keep_realtime and d.realtime)
+        ]
+
+        delta = self.delta
+        if grouped and dirs:
+            # Departures showing the same ETA text are grouped
+            groups = {}
+            for d in deps:
+                key = min(max(delta(d.eta), 0), 99)
+                groups.setdefault(key, []).append(d)
+            rows = [
+                (
+                    (g[0].line, g[0].name, g[0].eta)
+                    if len(g) == 1
+                    else (", ".join([d.line for d in g]), "", g[0].eta)
+                )
+                for g in groups.values()
+            ]
+        else:
+            rows = [(d.line, d.name, d.eta) for d in deps]
+
+        out = []
+        rendered = self.rendered
+        for row in rows:
+            mins = delta(row[2])
+            key = row + (0 < long_eta < mins,)
+            text = rendered.get(key)
+            if text is None:
+                text = rendered[key] = self.format_row(row, mins, key[3])
+            out.append(text)
+        return "".join(out)
+
+
+def format_departure_lists(jobs, *, now=None):
+    """
+    Render a batch of boards. `jobs` is an iterable of `(departures,
+    options)`, where options is a dict of format_departure_list arguments.
+    Returns the boards in the same order.
+    """
+    renderer = BatchRenderer(now)
+    return [renderer.render(deps, **options) for deps, options in jobs]
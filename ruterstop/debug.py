@@ -0,0 +1,235 @@
+"""
+Opt-in debug routes for finding hot spots in a running `--server`.
+
+Nothing in this module is imported, registered or wrapped unless
+`install_debug_routes` is called, so a server started without a debug token
+pays nothing for it. Every route requires the token given at install time,
+passed as an `Authorization: Bearer <token>` header. It is not accepted in the
+querystring, which ends up in request logs.
+
+- `POST /debug/profile?seconds=N` or `?requests=N` starts a CPU profile that
+  covers the requests handled until the limit is reached
+- `GET /debug/profile?sort=cumulative&limit=30` returns the sorted pstats
+- `POST /debug/tracemalloc` starts tracing and takes a baseline snapshot
+- `GET /debug/tracemalloc?limit=20` takes a new snapshot and returns the
+  difference from the previous one
+- `DELETE /debug/tracemalloc` stops tracing
+"""
+
+import cProfile
+import hmac
+import io
+import logging
+import pstats
+import time
+import tracemalloc
+from functools import wraps
+
+import bottle
+
+log = logging.getLogger("ruterstop")
+
+DEBUG_ROUTE_PREFIX = "/debug/"
+
+
+class ProfileSession:
+    """
+    A CPU profile collected across requests until either `seconds` have
+    passed or `requests` requests have been handled.
+    """
+
+    def __init__(self, *, seconds=None, requests=None, clock=time.monotonic):
+        self.profiler = cProfile.Profile()
+        self.clock = clock
+        self.deadline = clock() + seconds if seconds else None
+        self.max_requests = requests
+        self.requests = 0
+
+    @property
+    def done(self):
+        if self.max_requests is not None and self.requests >= self.max_requests:
+            return True
+        if self.deadline is not None and self.clock() >= self.deadline:
+            return True
+        return False
+
+    def stats(self, *, sort="cumulative", limit=30):
+        """Return the collected profile as sorted pstats text"""
+        if self.requests == 0:
+            return "No requests profiled yet\n"
+        out = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=out)
+        stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+
+class ProfilerPlugin:
+    """
+    Bottle plugin that runs route callbacks under the active ProfileSession.
+    Debug routes themselves are never profiled.
+    """
+
+    name = "ruterstop-profiler"
+    api = 2
+
+    def __init__(self):
+        self.session = None
+
+    def apply(self, callback, route):
+        if route.rule.startswith(DEBUG_ROUTE_PREFIX):
+            return callback
+
+        @wraps(callback)
+        def wrapper(*args, **kwargs):
+            session = self.session
+            if session is None or session.done:
+                return callback(*args, **kwargs)
+
+            session.profiler.enable()
+            try:
+                return callback(*args, **kwargs)
+            finally:
+                session.profiler.disable()
+                session.requests += 1
+
+        return wrapper
+
+
+class MemoryTracer:
+    """Takes tracemalloc snapshots and diffs each against the previous one"""
+
+    def __init__(self):
+        self.previous = None
+
+    @property
+    def running(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, *, frames=1):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(frames)
+        self.previous = self.snapshot()
+
+    def stop(self):
+        tracemalloc.stop()
+        self.previous = None
+
+    @staticmethod
+    def snapshot():
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+                tracemalloc.Filter(False, "<unknown>"),
+            )
+        )
+
+    def diff(self, *, key_type="lineno", limit=20):
+        """Return the top differences since the previous snapshot as text"""
+        current = self.snapshot()
+        diffs = current.compare_to(self.previous, key_type)
+        self.previous = current
+
+        size, peak = tracemalloc.get_traced_memory()
+        lines = ["traced: {} B, peak: {} B".format(size, peak)]
+        lines.extend(str(d) for d in diffs[:limit])
+        return "\n".join(lines) + "\n"
+
+
+def _text(body, status=200):
+    bottle.response.status = status
+    bottle.response.set_header("Content-Type", "text/plain")
+    return body
+
+
+def _int_param(value, name):
+    try:
+        return int(value) if value else None
+    except ValueError:
+        raise ValueError("{} must be an integer".format(name))
+
+
+def install_debug_routes(app, *, token):
+    """
+    Add the authenticated debug routes and the profiler plugin to `app`.
+    Returns the installed ProfilerPlugin and MemoryTracer.
+    """
+    if not token:
+        raise ValueError("a non-empty debug token is required")
+
+    plugin = ProfilerPlugin()
+    tracer = MemoryTracer()
+
+    def authenticated(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            auth = bottle.request.get_header("Authorization", "")
+            given = auth[len("Bearer ") :] if auth.startswith("Bearer ") else ""
+            if not hmac.compare_digest(given.encode(), token.encode()):
+                return _text("Ikke autorisert", 401)
+            try:
+                return func(*args, **kwargs)
+            except ValueError as e:
+                return _text(str(e), 400)
+
+        return wrapper
+
+    @app.post("/debug/profile")
+    @authenticated
+    def start_profile():
+        q = bottle.request.query
+        seconds = _int_param(q.seconds, "seconds")
+        requests = _int_param(q.requests, "requests")
+        if not seconds and not requests:
+            raise ValueError("seconds or requests is required")
+
+        plugin.session = ProfileSession(seconds=seconds, requests=requests)
+        log.info("Started profiling (seconds=%s, requests=%s)", seconds, requests)
+        return _text("Profiling started\n")
+
+    @app.get("/debug/profile")
+    @authenticated
+    def get_profile():
+        session = plugin.session
+        if session is None:
+            return _text("No profile has been started\n", 404)
+
+        q = bottle.request.query
+        limit = _int_param(q.limit, "limit") or 30
+        sort = q.sort or "cumulative"
+        if sort not in pstats.Stats.sort_arg_dict_default:
+            raise ValueError("invalid sort key: " + sort)
+
+        status = "done" if session.done else "running"
+        header = "status: {}, requests: {}\n".format(status, session.requests)
+        return _text(header + session.stats(sort=sort, limit=limit))
+
+    @app.post("/debug/tracemalloc")
+    @authenticated
+    def start_tracemalloc():
+        frames = _int_param(bottle.request.query.frames, "frames") or 1
+        tracer.start(frames=frames)
+        log.info("Started tracemalloc with %d frame(s)", frames)
+        return _text("Tracing started\n")
+
+    @app.get("/debug/tracemalloc")
+    @authenticated
+    def diff_tracemalloc():
+        if not tracer.running or tracer.previous is None:
+            return _text("Tracing has not been started\n", 404)
+
+        q = bottle.request.query
+        limit = _int_param(q.limit, "limit") or 20
+        key_type = q.key or "lineno"
+        if key_type not in ("lineno", "filename", "traceback"):
+            raise ValueError("invalid key: " + key_type)
+        return _text(tracer.diff(key_type=key_type, limit=limit))
+
+    @app.delete("/debug/tracemalloc")
+    @authenticated
+    def stop_tracemalloc():
+        tracer.stop()
+        return _text("Tracing stopped\n")
+
+    app.install(plugin)
+    return plugin, tracer
@@ -0,0 +1,134 @@
+"""
+Persistent cache of API responses, shared between CLI invocations.
+
+Each key is stored in its own file as a compact record: a fixed size header
+with a magic number, the wall clock time it was written and the payload
+length, followed by the JSON payload. Reads memory-map the file and check the
+header before decoding anything, so an expired entry costs one small read.
+
+Writes go to a temporary file that is renamed into place, so readers never
+see a partial record. Fetching is serialized per key with a lock file, so
+concurrent invocations share one upstream fetch per TTL window.
+"""
+
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import tempfile
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover (not available on Windows)
+    fcntl = None
+
+log = logging.getLogger("ruterstop")
+
+MAGIC = b"RST1"
+HEADER = struct.Struct("<4sdI")  # magic, timestamp, payload length
+
+
+def default_cache_dir():
+    """Return the ruterstop directory in the XDG cache directory"""
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "ruterstop")
+
+
+class DiskCache:
+    """
+    A directory of cache entries that expire `ttl` seconds after they were
+    written. The clock must be wall clock time, as entries are shared between
+    processes.
+    """
+
+    def __init__(self, directory, *, ttl=30, clock=time.time):
+        self.directory = directory
+        self.ttl = ttl
+        self.clock = clock
+
+    def path(self, key):
+        return os.path.join(self.directory, re.sub(r"[^\w-]", "_", str(key)))
+
+    def read(self, key):
+        """Return the cached value of `key`, or None if missing or expired"""
+        try:
+            with open(self.path(key), "rb") as fp:
+                with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if len(mm) < HEADER.size:
+                        return None
+                    magic, timestamp, length = HEADER.unpack_from(mm)
+                    if magic != MAGIC or HEADER.size + length > len(mm):
+                        return None
+                    if not 0 <= self.clock() - timestamp < self.ttl:
+                        return None
+                    return json.loads(mm[HEADER.size : HEADER.size + length].decode())
+        except (OSError, ValueError):
+            # Missing, empty or corrupt entries are cache misses
+            return None
+
+    def write(self, key, value):
+        """Atomically replace the cached value of `key`"""
+        payload = json.dumps(value, separators=(",", ":")).encode()
+        record = HEADER.pack(MAGIC, self.clock(), len(payload)) + payload
+
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(record)
+            os.replace(tmp, self.path(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @contextmanager
+    def lock(self, key):
+        """
+        Hold an exclusive lock on `key` across processes. Continues without
+        a lock where file locking is not supported or fails.
+        """
+        if fcntl is None:
+            yield
+            return
+
+        try:
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            fp = open(self.path(key) + ".lock", "a")
+        except OSError as e:
+            log.warning("Could not lock disk cache entry: %s", e)
+            yield
+            return
+
+        with fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def get(self, key, fetch):
+        """
+        Return the cached value of `key`, or call `fetch` and cache its return
+        value. Only one process fetches a key at a time, and the others use
+        the value it wrote.
+        """
+        value = self.read(key)
+        if value is not None:
+            return value
+
+        with self.lock(key):
+            # Another process may have fetched while we waited for the lock
+            value = self.read(key)
+            if value is None:
+                value = fetch()
+                try:
+                    self.write(key, value)
+                except OSError as e:
+                    log.warning("Could not write to disk cache: %s", e)
+            return value
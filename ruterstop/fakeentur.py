@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+A local stand-in for the EnTur JourneyPlanner and stop-places GraphQL APIs.
+
+Serves recorded or synthetic departures for any stop ID, with configurable
+latency, error rate and payload size, and counts every call it receives.
+Point ruterstop at it with the endpoint environment variables:
+
+    $ ruterstop-fake-entur --port 4100 --latency normal:80:20 --error-rate 0.01
+    $ export RUTERSTOP_ENTUR_GRAPHQL_ENDPOINT=http://localhost:4100/journey-planner/v2/graphql
+    $ export RUTERSTOP_ENTUR_STOP_PLACE_ENDPOINT=http://localhost:4100/stop-places/v1/graphql
+    $ ruterstop --server
+
+Call counts are available as JSON from `GET /_stats` and are cleared with
+`POST /_reset`.
+"""
+
+import argparse
+import json
+import logging
+import math
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from wsgiref.simple_server import WSGIRequestHandler, make_server
+
+import bottle
+
+from ruterstop.server import ThreadingWSGIServer
+
+log = logging.getLogger("ruterstop.fakeentur")
+
+JOURNEY_PLANNER_PATH = "/journey-planner/v2/graphql"
+STOP_PLACE_PATH = "/stop-places/v1/graphql"
+DATE_FMT = "%Y-%m-%dT%H:%M:%S%z"
+
+DESTINATIONS = [
+    ("Snarøya", "Tonsenhagen"),
+    ("Majorstuen", "Lørenskog stasjon"),
+    ("Fornebu", "Grorud T"),
+    ("Bærums verk", "Helsfyr T"),
+    ("Ås stasjon", "Økern"),
+    ("Jernbanetorget", "Sandvika"),
+    ("Ullevål stadion", "Bekkestua"),
+]
+HEADWAYS_MIN = [5, 7.5, 10, 15, 20, 30]
+PLACES = [("Oslo", "Oslo"), ("Bærum", "Viken"), ("Lillestrøm", "Viken")]
+
+
+def parse_latency(spec):
+    """
+    Parse a latency distribution spec into a function taking a Random
+    instance and returning a delay in seconds. All values are milliseconds.
+
+    - `50` or `fixed:50`
+    - `uniform:20:200`
+    - `normal:100:30` (mean, standard deviation)
+    - `lognormal:80:0.5` (median, sigma)
+    - `exp:100` (mean)
+    """
+    name, _, rest = spec.partition(":")
+    if not rest:
+        name, rest = "fixed", name
+    try:
+        args = [float(a) for a in rest.split(":")]
+    except ValueError:
+        raise ValueError("invalid latency spec: " + spec)
+
+    dists = {
+        ("fixed", 1): lambda rnd: args[0],
+        ("uniform", 2): lambda rnd: rnd.uniform(args[0], args[1]),
+        ("normal", 2): lambda rnd: rnd.gauss(args[0], args[1]),
+        ("lognormal", 2): lambda rnd: rnd.lognormvariate(math.log(args[0]), args[1]),
+        ("exp", 1): lambda rnd: rnd.expovariate(1 / args[0]) if args[0] else 0,
+    }
+    dist = dists.get((name, len(args)))
+    if dist is None:
+        raise ValueError("invalid latency spec: " + spec)
+    return lambda rnd: max(0, dist(rnd)) / 1000
+
+
+def synthetic_departures(stop_id, count, *, now=None, seed=0):
+    """
+    Return a JourneyPlanner stopPlace response with the next `count`
+    departures from `stop_id`.
+
+    Each stop gets its own deterministic set of lines running on fixed
+    headways, so ETAs count down between calls like they would upstream.
+    """
+    now = (now or datetime.now()).astimezone().replace(microsecond=0)
+    rnd = random.Random("{}:{}".format(seed, stop_id))
+    epoch = now.replace(hour=0, minute=0, second=0)
+
+    calls = []
+    for _ in range(rnd.randint(2, 5)):
+        code = str(rnd.randint(1, 99))
+        pair = rnd.choice(DESTINATIONS)
+        headway = int(rnd.choice(HEADWAYS_MIN) * 60)
+        for direction, dest in zip(("outbound", "inbound"), pair):
+            offset = rnd.randrange(headway)
+            elapsed = (now - epoch).total_seconds() - offset
+            first = offset + (int(elapsed // headway) + 1) * headway
+            for i in range(count):
+                secs = first + i * headway
+                # Deterministic delay per departure to look like realtime data
+                delay = (secs * 7919 + offset) % 90
+                calls.append(
+                    dict(
+                        realtime=delay % 5 != 0,
+                        expectedArrivalTime=epoch + timedelta(seconds=secs + delay),
+                        destinationDisplay=dict(frontText=dest),
+                        serviceJourney=dict(
+                            id="RUT:ServiceJourney:{}-{}-{}".format(
+                                code, direction[0], secs
+                            ),
+                            directionType=direction,
+                            line=dict(publicCode=code),
+                        ),
+                    )
+                )
+
+    calls.sort(key=lambda c: c["expectedArrivalTime"])
+    calls = calls[:count]
+    for c in calls:
+        c["expectedArrivalTime"] = c["expectedArrivalTime"].strftime(DATE_FMT)
+
+    return dict(
+        data=dict(
+            stopPlace=dict(
+                id="NSR:StopPlace:{}".format(stop_id),
+                name="Stoppested {}".format(stop_id),
+                estimatedCalls=calls,
+            )
+        )
+    )
+
+
+def shift_departures(raw_dict, *, now=None, count=None):
+    """
+    Return a copy of a recorded JourneyPlanner response with all departures
+    moved so the first one departs at `now`.
+    """
+    now = (now or datetime.now()).astimezone().replace(microsecond=0)
+    raw = json.loads(json.dumps(raw_dict))
+    stop = raw["data"]["stopPlace"]
+    if not stop or not stop["estimatedCalls"]:
+        return raw
+
+    calls = stop["estimatedCalls"][:count] if count else stop["estimatedCalls"]
+    first = datetime.strptime(calls[0]["expectedArrivalTime"], DATE_FMT)
+    shift = now - first
+    for c in calls:
+        eta = datetime.strptime(c["expectedArrivalTime"], DATE_FMT) + shift
+        c["expectedArrivalTime"] = eta.astimezone(now.tzinfo).strftime(DATE_FMT)
+    stop["estimatedCalls"] = calls
+    return raw
+
+
+def synthetic_stop_search(name, *, count=5):
+    """Return a stop-places response with `count` stops matching `name`"""
+    rnd = random.Random(name)
+    stops = []
+    for i in range(count):
+        region, parent = rnd.choice(PLACES)
+        stops.append(
+            dict(
+                id="NSR:StopPlace:{}".format(rnd.randint(1000, 99999)),
+                topographicPlace=dict(
+                    name=dict(value=region),
+                    parentTopographicPlace=dict(name=dict(value=parent)),
+                ),
+                name=dict(value=name.title() + (" {}".format(i) if i else "")),
+            )
+        )
+    return dict(data=dict(stopPlace=stops))
+
+
+class FakeEnTur:
+    """
+    The fake API as a bottle app, with its configuration and call counters.
+
+    `recordings` maps stop IDs to recorded responses. A recording under the
+    key "*" is used for all other stops. Stops without a recording get
+    synthetic departures.
+    """
+
+    def __init__(
+        self,
+        *,
+        departures=20,
+        latency="0",
+        error_rate=0.0,
+        error_status=500,
+        recordings=None,
+        seed=0,
+        sleep=time.sleep,
+    ):
+        self.departures = departures
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.recordings = recordings or {}
+        self.seed = seed
+        self.sleep = sleep
+
+        self.rnd = random.Random(seed)
+        self.lock = threading.Lock()
+        self.reset()
+
+        self.app = bottle.Bottle()
+        self.app.post(JOURNEY_PLANNER_PATH)(self.journey_planner)
+        self.app.post(STOP_PLACE_PATH)(self.stop_places)
+        self.app.get("/_stats")(self.stats)
+        self.app.post("/_reset")(self.reset)
+
+    def reset(self):
+        with self.lock:
+            self.calls = Counter()
+            self.stops = Counter()
+            self.errors = 0
+        return ""
+
+    def stats(self):
+        with self.lock:
+            return dict(
+                calls=dict(self.calls),
+                stops={str(k): v for k, v in self.stops.items()},
+                errors=self.errors,
+            )
+
+    def _begin(self, endpoint):
+        """Count the call, apply latency and decide whether it should fail"""
+        with self.lock:
+            self.calls[endpoint] += 1
+            delay = self.latency(self.rnd)
+            fail = self.rnd.random() < self.error_rate
+            if fail:
+                self.errors += 1
+        if delay:
+            self.sleep(delay)
+
+        if fail:
+            bottle.response.status = self.error_status
+            return dict(errors=[dict(message="Simulated upstream error")])
+        return None
+
+    def _query(self):
+        body = bottle.request.json or {}
+        return body.get("query", "")
+
+    def journey_planner(self):
+        error = self._begin("journey_planner")
+        if error:
+            return error
+
+        query = self._query()
+        match = re.search(r"NSR:StopPlace:(\d+)", query)
+        if not match:
+            return dict(data=dict(stopPlace=None))
+        stop_id = match.group(1)
+
+        with self.lock:
+            self.stops[stop_id] += 1
+
+        recording = self.recordings.get(stop_id, self.recordings.get("*"))
+        if recording is not None:
+            raw = shift_departures(recording, count=self.departures)
+        else:
+            raw = synthetic_departures(stop_id, self.departures, seed=self.seed)
+
+        # Respect the time range of the query, like the real API
+        match = re.search(r"timeRange:\s*(\d+)", query)
+        if match and raw["data"]["stopPlace"]:
+            end = datetime.now().astimezone() + timedelta(seconds=int(match.group(1)))
+            calls = raw["data"]["stopPlace"]["estimatedCalls"]
+            raw["data"]["stopPlace"]["estimatedCalls"] = [
+                c
+                for c in calls
+                if datetime.strptime(c["expectedArrivalTime"], DATE_FMT) <= end
+            ]
+        return raw
+
+    def stop_places(self):
+        error = self._begin("stop_places")
+        if error:
+            return error
+
+        match = re.search(r'query:\s*"([^"]*)"', self._query())
+        return synthetic_stop_search(match.group(1) if match else "")
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        log.debug(*args)
+
+
+def make_fake_server(fake, *, host="127.0.0.1", port=0):
+    """Return a threaded WSGI server for `fake` that is ready to serve_forever"""
+    return make_server(
+        host,
+        port,
+        fake.app,
+        server_class=ThreadingWSGIServer,
+        handler_class=QuietHandler,
+    )
+
+
+def load_recordings(path):
+    """
+    Load a recording file. It can be a single JourneyPlanner response, used
+    for every stop, or an object of responses keyed by stop ID.
+    """
+    with open(path) as fp:
+        raw = json.load(fp)
+    if "data" in raw:
+        return {"*": raw}
+    return raw
+
+
+def main(argv=sys.argv, *, stdout=sys.stdout):
+    """Main function for CLI usage"""
+    par = argparse.ArgumentParser(prog="ruterstop-fake-entur")
+    par.add_argument("--host", default="127.0.0.1", metavar="<ip|hostname>")
+    par.add_argument("--port", type=int, default=4100, metavar="<port>")
+    par.add_argument(
+        "--departures",
+        type=int,
+        default=20,
+        metavar="<n>",
+        help="number of departures per response",
+    )
+    par.add_argument(
+        "--latency",
+        default="0",
+        metavar="<spec>",
+        help="latency in ms, e.g. 50, uniform:20:200, normal:100:30, lognormal:80:0.5, exp:100",
+    )
+    par.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        metavar="<ratio>",
+        help="share of requests that fail, between 0 and 1",
+    )
+    par.add_argument(
+        "--error-status",
+        type=int,
+        default=500,
+        metavar="<code>",
+        help="HTTP status code of failed requests",
+    )
+    par.add_argument(
+        "--recording",
+        metavar="<file>",
+        help="JSON file with a recorded response, or responses keyed by stop ID",
+    )
+    par.add_argument("--seed", type=int, default=0, metavar="<n>")
+    par.add_argument("--debug", action="store_true", help="log every request")
+    args = par.parse_args(argv[1:])
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+
+    try:
+        fake = FakeEnTur(
+            departures=args.departures,
+            latency=args.latency,
+            error_rate=args.error_rate,
+            error_status=args.error_status,
+            recordings=load_recordings(args.recording) if args.recording else None,
+            seed=args.seed,
+        )
+    except ValueError as e:
+        par.error(str(e))
+        return
+
+    httpd = make_fake_server(fake, host=args.host, port=args.port)
+    url = "http://{}:{}".format(args.host, httpd.server_port)
+    print("RUTERSTOP_ENTUR_GRAPHQL_ENDPOINT=" + url + JOURNEY_PLANNER_PATH, file=stdout)
+    print("RUTERSTOP_ENTUR_STOP_PLACE_ENDPOINT=" + url + STOP_PLACE_PATH, file=stdout)
+    stdout.flush()
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
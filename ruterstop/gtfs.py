@@ -0,0 +1,356 @@
+"""
+Planned departures from a locally downloaded GTFS timetable.
+
+`compile_gtfs` reads a GTFS feed (a zip file or a directory of .txt files)
+into a compact departure table, which is saved to and loaded from a single
+file. Departures are stored as parallel arrays sorted by stop and by time
+of the service day, with each stop owning one contiguous slice:
+
+- times: seconds after midnight of the service day (may pass 24:00:00)
+- service_ids: index of the calendar service the departure runs on
+- lines, destinations: indexes into a table of unique strings
+- directions: index into DIRECTIONS
+
+Looking up departures for a stop is a binary search per service day, and
+no upstream API calls. Platforms (quays) are folded into their parent stop
+place, so stops have the same numeric IDs as in the realtime API. Quays
+without a parent keep their full GTFS ID, as their numbers could be the ID
+of another stop place.
+
+Service days start at midnight, so departures on days when daylight saving
+time changes may be off by an hour.
+"""
+
+import csv
+import io
+import json
+import os
+import struct
+import sys
+import zipfile
+from array import array
+from bisect import bisect_left
+from datetime import date, datetime, timedelta
+
+from ruterstop import Departure
+from ruterstop.utils import norwegian_ascii
+
+MAGIC = b"RSTT"
+VERSION = 2
+LENGTH = struct.Struct("<I")
+
+# GTFS direction_id 0 and 1, and departures without one
+DIRECTIONS = ["outbound", "inbound", "unknown"]
+
+# Array typecodes of the departure table columns, in file order
+COLUMNS = [
+    ("times", "i"),
+    ("service_ids", "I"),
+    ("lines", "I"),
+    ("destinations", "I"),
+    ("directions", "B"),
+]
+
+
+def _numeric_id(gtfs_id):
+    """NSR:StopPlace:6013 -> 6013"""
+    return gtfs_id.rsplit(":", maxsplit=1).pop()
+
+
+def _parse_time(value):
+    """Parse a GTFS HH:MM:SS time into seconds, allowing hours past 24"""
+    h, m, s = value.strip().split(":")
+    return int(h) * 3600 + int(m) * 60 + int(s)
+
+
+def _parse_date(value):
+    return datetime.strptime(value.strip(), "%Y%m%d").date()
+
+
+class Service:
+    """The days a GTFS service_id runs on, from calendar and calendar_dates"""
+
+    def __init__(self, *, start=None, end=None, weekdays=(), added=(), removed=()):
+        self.start = start
+        self.end = end
+        self.weekdays = frozenset(weekdays)
+        self.added = set(added)
+        self.removed = set(removed)
+
+    def runs_on(self, day):
+        if day in self.removed:
+            return False
+        if day in self.added:
+            return True
+        return (
+            self.start is not None
+            and self.start <= day <= self.end
+            and day.weekday() in self.weekdays
+        )
+
+    def to_dict(self):
+        return dict(
+            start=self.start.isoformat() if self.start else None,
+            end=self.end.isoformat() if self.end else None,
+            weekdays=sorted(self.weekdays),
+            added=sorted(d.isoformat() for d in self.added),
+            removed=sorted(d.isoformat() for d in self.removed),
+        )
+
+    @classmethod
+    def from_dict(cls, d):
+        def parse(s):
+            return date(*map(int, s.split("-")))
+
+        return cls(
+            start=parse(d["start"]) if d["start"] else None,
+            end=parse(d["end"]) if d["end"] else None,
+            weekdays=d["weekdays"],
+            added=map(parse, d["added"]),
+            removed=map(parse, d["removed"]),
+        )
+
+
+class Timetable:
+    """A compiled departure table. Create with compile_gtfs or Timetable.load"""
+
+    def __init__(self, *, strings, services, stops, columns):
+        self.strings = strings
+        self.names = [norwegian_ascii(s) for s in strings]
+        self.services = services
+        self.stops = stops
+        for name, _ in COLUMNS:
+            setattr(self, name, columns[name])
+        self.max_time = max(self.times) if self.times else 0
+        self._active = {}
+
+    def __len__(self):
+        return len(self.times)
+
+    def __contains__(self, stop_id):
+        return str(stop_id) in self.stops
+
+    def active_services(self, day):
+        """Return the set of service indexes running on `day`"""
+        active = self._active.get(day)
+        if active is None:
+            active = frozenset(i for i, s in enumerate(self.services) if s.runs_on(day))
+            self._active[day] = active
+        return active
+
+    def departures(self, stop_id, *, since, until=None, count=None):
+        """
+        Return planned departures from `stop_id` at or after `since` and
+        before `until`, as Departure objects sorted by ETA. Stops at `count`
+        departures if given.
+        """
+        span = self.stops.get(str(stop_id))
+        if span is None:
+            return []
+        lo, hi = span
+        until = until or since + timedelta(days=1)
+
+        found = []
+        # Service days that started before `since` may still have departures
+        # with times past 24:00:00
+        day = since.date() - timedelta(days=self.max_time // 86400)
+        while day <= until.date():
+            midnight = datetime(day.year, day.month, day.day)
+            start = (since - midnight).total_seconds()
+            end = (until - midnight).total_seconds()
+            active = self.active_services(day)
+
+            i = bisect_left(self.times, start, lo, hi)
+            while i < hi and self.times[i] < end:
+                if self.service_ids[i] in active:
+                    found.append((midnight, i))
+                i += 1
+            day += timedelta(days=1)
+
+        deps = sorted(
+            (
+                Departure(
+                    line=self.strings[self.lines[i]],
+                    name=self.names[self.destinations[i]],
+                    eta=midnight + timedelta(seconds=self.times[i]),
+                    direction=DIRECTIONS[self.directions[i]],
+                    realtime=False,
+                )
+                for midnight, i in found
+            ),
+            key=lambda d: d.eta,
+        )
+        return deps[:count] if count else deps
+
+    def save(self, path):
+        """Write the table to `path`, replacing it atomically"""
+        header = json.dumps(
+            dict(
+                version=VERSION,
+                byteorder=sys.byteorder,
+                count=len(self),
+                strings=self.strings,
+                services=[s.to_dict() for s in self.services],
+                stops=self.stops,
+            ),
+            separators=(",", ":"),
+        ).encode()
+
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as fp:
+            fp.write(MAGIC + LENGTH.pack(len(header)) + header)
+            for name, _ in COLUMNS:
+                getattr(self, name).tofile(fp)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a table written by save"""
+        with open(path, "rb") as fp:
+            if fp.read(len(MAGIC)) != MAGIC:
+                raise ValueError("not a ruterstop timetable: " + path)
+            (length,) = LENGTH.unpack(fp.read(LENGTH.size))
+            header = json.loads(fp.read(length).decode())
+            if header["version"] != VERSION:
+                raise ValueError("unsupported timetable version, import it again")
+
+            columns = {}
+            for name, typecode in COLUMNS:
+                col = array(typecode)
+                col.fromfile(fp, header["count"])
+                if header["byteorder"] != sys.byteorder:
+                    col.byteswap()
+                columns[name] = col
+
+        return cls(
+            strings=header["strings"],
+            services=[Service.from_dict(s) for s in header["services"]],
+            stops={k: tuple(v) for k, v in header["stops"].items()},
+            columns=columns,
+        )
+
+
+class _Feed:
+    """Reads GTFS files from a zip file or a directory"""
+
+    def __init__(self, source):
+        self.source = source
+        self.zip = zipfile.ZipFile(source) if zipfile.is_zipfile(source) else None
+
+    def rows(self, name, *, required=True):
+        if self.zip:
+            if name not in self.zip.namelist():
+                if required:
+                    raise ValueError("missing {} in {}".format(name, self.source))
+                return
+            raw = self.zip.open(name)
+        else:
+            path = os.path.join(self.source, name)
+            if not os.path.exists(path):
+                if required:
+                    raise ValueError("missing {} in {}".format(name, self.source))
+                return
+            raw = open(path, "rb")
+
+        with io.TextIOWrapper(raw, encoding="utf-8-sig", newline="") as fp:
+            yield from csv.DictReader(fp)
+
+
+def compile_gtfs(source, *, stop_ids=None):
+    """
+    Compile the GTFS feed at `source` into a Timetable. Only departures from
+    `stop_ids` are included if given.
+    """
+    feed = _Feed(source)
+    wanted = set(map(str, stop_ids)) if stop_ids else None
+
+    strings = []
+    string_index = {}
+
+    def intern(s):
+        if s not in string_index:
+            string_index[s] = len(strings)
+            strings.append(s)
+        return string_index[s]
+
+    # Platforms are folded into their parent stop place
+    parents = {}
+    for row in feed.rows("stops.txt"):
+        if row.get("parent_station"):
+            parents[row["stop_id"]] = _numeric_id(row["parent_station"])
+        elif row.get("location_type") == "1":
+            parents[row["stop_id"]] = _numeric_id(row["stop_id"])
+        else:
+            parents[row["stop_id"]] = row["stop_id"]
+
+    lines = {}
+    for row in feed.rows("routes.txt"):
+        lines[row["route_id"]] = row.get("route_short_name") or row.get(
+            "route_long_name", ""
+        )
+
+    services = {}
+
+    def service(service_id):
+        if service_id not in services:
+            services[service_id] = (len(services), Service())
+        return services[service_id]
+
+    for row in feed.rows("calendar.txt", required=False):
+        _, s = service(row["service_id"])
+        s.start = _parse_date(row["start_date"])
+        s.end = _parse_date(row["end_date"])
+        days = ["monday", "tuesday", "wednesday", "thursday", "friday"]
+        days += ["saturday", "sunday"]
+        s.weekdays = frozenset(i for i, d in enumerate(days) if row[d] == "1")
+
+    for row in feed.rows("calendar_dates.txt", required=False):
+        _, s = service(row["service_id"])
+        day = _parse_date(row["date"])
+        (s.added if row["exception_type"] == "1" else s.removed).add(day)
+
+    trips = {}
+    for row in feed.rows("trips.txt"):
+        direction = row.get("direction_id", "")
+        trips[row["trip_id"]] = (
+            intern(lines.get(row["route_id"], "")),
+            service(row["service_id"])[0],
+            row.get("trip_headsign", ""),
+            int(direction) if direction in ("0", "1") else 2,
+        )
+
+    rows = []
+    for row in feed.rows("stop_times.txt"):
+        # Skip stops where passengers can't board, like the end of the line
+        if row.get("pickup_type") == "1" or not row.get("departure_time"):
+            continue
+        stop = parents.get(row["stop_id"], row["stop_id"])
+        if wanted is not None and stop not in wanted:
+            continue
+        trip = trips.get(row["trip_id"])
+        if trip is None:
+            continue
+
+        line, svc, headsign, direction = trip
+        dest = intern(row.get("stop_headsign") or headsign)
+        rows.append(
+            (stop, _parse_time(row["departure_time"]), svc, line, dest, direction)
+        )
+
+    rows.sort()
+
+    columns = {name: array(typecode) for name, typecode in COLUMNS}
+    stops = {}
+    for i, (stop, *values) in enumerate(rows):
+        if stop not in stops:
+            stops[stop] = [i, i]
+        stops[stop][1] = i + 1
+        for (name, _), value in zip(COLUMNS, values):
+            columns[name].append(value)
+
+    return Timetable(
+        strings=strings,
+        services=[s for _, s in sorted(services.values(), key=lambda v: v[0])],
+        stops={k: tuple(v) for k, v in stops.items()},
+        columns=columns,
+    )
@@ -0,0 +1,247 @@
+"""
+Load generator for a running `ruterstop --server`.
+
+Requests `/<stop_id>` with a realistic mix of querystrings, picking stops
+from a popularity distribution, either as fast as `concurrency` workers
+allow or at a fixed target rate.
+
+When a target rate is given, latency is measured from the time a request was
+scheduled to be sent, so a slow server is not hidden by the generator
+falling behind.
+"""
+
+import math
+import random
+import threading
+import time
+from collections import Counter, namedtuple
+from urllib.parse import urlencode
+
+QUERY_PARAMS = [
+    # (probability of being included, function returning a value)
+    (0.5, lambda rnd: ("direction", rnd.choice(["inbound", "outbound"]))),
+    (0.3, lambda rnd: ("min_eta", rnd.choice([1, 2, 3, 5, 10]))),
+    (0.2, lambda rnd: ("grouped", 1)),
+    (0.3, lambda rnd: ("long_eta", rnd.choice([-1, 15, 30, 59]))),
+]
+
+
+def popularity_weights(count, spec="zipf:1"):
+    """
+    Return `count` weights from a popularity distribution spec, either
+    `uniform` or `zipf:<exponent>`. The first item is the most popular.
+    """
+    name, _, arg = spec.partition(":")
+    if name == "uniform" and not arg:
+        return [1.0] * count
+    if name == "zipf":
+        try:
+            s = float(arg) if arg else 1.0
+        except ValueError:
+            raise ValueError("invalid popularity spec: " + spec)
+        return [1 / (rank**s) for rank in range(1, count + 1)]
+    raise ValueError("invalid popularity spec: " + spec)
+
+
+def parse_stops(spec, *, popularity="zipf:1"):
+    """
+    Parse a comma separated list of stops into a list of (stop_id, weight).
+
+    Items can be a stop ID (`6013`), a range of stop IDs (`6000-6099`), or
+    either with an explicit weight (`6013=25`, `6000-6099=5`), which applies
+    to each stop in a range. Items without a weight get one from the
+    `popularity` distribution, in the order they are listed.
+    """
+    stops = []
+    explicit = {}
+    for item in filter(None, (s.strip() for s in spec.split(","))):
+        stop, _, weight = item.partition("=")
+        lo, _, hi = stop.partition("-")
+        try:
+            if hi:
+                ids = [str(i) for i in range(int(lo), int(hi) + 1)]
+            else:
+                ids = [str(int(stop))]
+            if weight:
+                explicit.update(dict.fromkeys(ids, float(weight)))
+            stops.extend(ids)
+        except ValueError:
+            raise ValueError("invalid stop: " + item)
+
+    if not stops:
+        raise ValueError("no stops given")
+
+    weights = popularity_weights(len(stops), popularity)
+    return [(s, explicit.get(s, w)) for s, w in zip(stops, weights)]
+
+
+def random_path(rnd, stops, weights):
+    """Return a request path for a random stop with a random querystring"""
+    stop = rnd.choices(stops, weights)[0]
+    params = [param(rnd) for p, param in QUERY_PARAMS if rnd.random() < p]
+    path = "/" + stop
+    if params:
+        path += "?" + urlencode(params)
+    return path
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Report(
+    namedtuple("Report", ["requests", "errors", "elapsed", "latencies", "stops"])
+):
+    """Result of a load test run"""
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    def latency(self, pct):
+        return percentile(self.latencies, pct)
+
+    def __str__(self):
+        lines = [
+            "requests:    {}".format(self.requests),
+            "errors:      {}".format(sum(self.errors.values())),
+        ]
+        for kind, count in self.errors.most_common():
+            lines.append("  {:24}{:>8}".format(kind, count))
+        lines.append("duration:    {:.2f} s".format(self.elapsed))
+        lines.append("throughput:  {:.1f} req/s".format(self.throughput))
+        for name, pct in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100)):
+            lines.append("latency {}: {:.2f} ms".format(name, self.latency(pct) * 1000))
+        return "\n".join(lines)
+
+
+def http_fetcher(timeout=10):
+    """
+    Return a function that GETs a URL and returns the HTTP status code,
+    keeping one HTTP session per worker thread.
+    """
+    import requests
+
+    local = threading.local()
+
+    def fetch(url):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        res = session.get(url, timeout=timeout)
+        res.content  # pylint: disable=pointless-statement
+        return res.status_code
+
+    return fetch
+
+
+class LoadGenerator:
+    """
+    Drives `base_url` with `concurrency` worker threads until `duration`
+    seconds have passed or `max_requests` requests have been sent.
+
+    With `rate` set, requests are scheduled at that many per second in total.
+    Otherwise every worker sends its next request as soon as the previous
+    one completes.
+    """
+
+    def __init__(
+        self,
+        base_url,
+        stops,
+        *,
+        concurrency=1,
+        rate=None,
+        duration=None,
+        max_requests=None,
+        seed=None,
+        fetch=None,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        if not duration and not max_requests:
+            raise ValueError("duration or max_requests is required")
+
+        self.base_url = base_url.rstrip("/")
+        self.stops = [s for s, _ in stops]
+        self.weights = [w for _, w in stops]
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.max_requests = max_requests
+        self.rnd = random.Random(seed)
+        self.fetch = fetch or http_fetcher()
+        self.clock = clock
+        self.sleep = sleep
+
+        self.lock = threading.Lock()
+        self.sent = 0
+        self.latencies = []
+        self.errors = Counter()
+        self.stop_counts = Counter()
+
+    def _next(self, start):
+        """
+        Claim the next request. Returns its path and scheduled start time,
+        or None when the run is over.
+        """
+        with self.lock:
+            if self.max_requests and self.sent >= self.max_requests:
+                return None
+            scheduled = start + self.sent / self.rate if self.rate else None
+            now = self.clock()
+            if self.duration and max(now, scheduled or now) >= start + self.duration:
+                return None
+            self.sent += 1
+            path = random_path(self.rnd, self.stops, self.weights)
+            self.stop_counts[path[1:].split("?")[0]] += 1
+        return path, scheduled
+
+    def _worker(self, start):
+        while True:
+            claim = self._next(start)
+            if claim is None:
+                return
+            path, scheduled = claim
+
+            if scheduled is not None:
+                wait = scheduled - self.clock()
+                if wait > 0:
+                    self.sleep(wait)
+            began = scheduled if scheduled is not None else self.clock()
+
+            try:
+                status = self.fetch(self.base_url + path)
+                error = None if 200 <= status < 400 else "HTTP {}".format(status)
+            except Exception as e:  # pylint: disable=broad-except
+                error = type(e).__name__
+            elapsed = self.clock() - began
+
+            with self.lock:
+                self.latencies.append(elapsed)
+                if error:
+                    self.errors[error] += 1
+
+    def run(self):
+        """Run the load test and return a Report"""
+        start = self.clock()
+        workers = [
+            threading.Thread(target=self._worker, args=(start,), daemon=True)
+            for _ in range(self.concurrency)
+        ]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+
+        return Report(
+            requests=len(self.latencies),
+            errors=self.errors,
+            elapsed=self.clock() - start,
+            latencies=sorted(self.latencies),
+            stops=self.stop_counts,
+        )
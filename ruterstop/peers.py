@@ -0,0 +1,168 @@
+"""
+Cluster mode for running `--server` on several nodes.
+
+Every node is given the same list of node URLs. Stop IDs are assigned to
+owner nodes by consistent hashing, and only the owner of a stop requests it
+from EnTur. Other nodes ask the owner over HTTP, at `/_cluster/stop/<id>`,
+and keep the answer in a small near-cache until the owner's copy expires.
+Upstream load then grows with the number of distinct stops, not with the
+number of nodes.
+
+If the owner can't be reached, the node requests the stop from EnTur itself.
+"""
+
+import hashlib
+import logging
+import threading
+from bisect import bisect
+from collections import OrderedDict
+
+from ruterstop import utils
+
+log = logging.getLogger("ruterstop")
+
+# Points per node on the hash ring. More points spread stops more evenly.
+REPLICAS = 64
+
+# Stops from other nodes kept in the near-cache
+NEAR_CACHE_SIZE = 256
+
+PEER_TIMEOUT_SEC = 2
+
+
+def _hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """Consistent hashing of keys onto nodes"""
+
+    def __init__(self, nodes, *, replicas=REPLICAS):
+        if not nodes:
+            raise ValueError("a cluster needs at least one node")
+        self.nodes = sorted(set(nodes))
+        points = sorted(
+            (_hash("{}#{}".format(node, i)), node)
+            for node in self.nodes
+            for i in range(replicas)
+        )
+        self.hashes = [h for h, _ in points]
+        self.owners = [node for _, node in points]
+
+    def owner(self, key):
+        i = bisect(self.hashes, _hash(str(key))) % len(self.hashes)
+        return self.owners[i]
+
+
+class NearCache:
+    """
+    A least recently used cache of stops owned by other nodes. Entries expire
+    at the time given when they are stored, on the monotonic clock.
+    """
+
+    def __init__(self, *, size=NEAR_CACHE_SIZE, clock=utils.monotonic):
+        self.size = size
+        self.clock = clock
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if self.clock() >= expires:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def ttl(self, key):
+        """Return the seconds until an entry expires, or None if there is none"""
+        with self.lock:
+            entry = self.entries.get(key)
+            left = entry[1] - self.clock() if entry else 0
+        return left if left > 0 else None
+
+    def put(self, key, value, *, ttl):
+        if ttl <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (value, self.clock() + ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+
+def normalize_url(url):
+    return url.rstrip("/")
+
+
+class Cluster:
+    """
+    This node's view of the cluster. `fetch_local(stop_id, time_range)` gets
+    a stop through this node's own cache and upstream, and `request(url,
+    params)` GETs JSON from another node.
+    """
+
+    def __init__(
+        self,
+        *,
+        nodes,
+        self_url,
+        fetch_local,
+        cache_sec,
+        near_cache=None,
+        request=None,
+    ):
+        nodes = [normalize_url(n) for n in nodes]
+        self.self_url = normalize_url(self_url)
+        if self.self_url not in nodes:
+            raise ValueError("this node is not in the cluster: " + self_url)
+
+        self.ring = HashRing(nodes)
+        self.fetch_local = fetch_local
+        self.cache_sec = cache_sec
+        self.near_cache = near_cache or NearCache()
+        self.request = request or self.http_get
+        self.local = threading.local()
+
+    def owner(self, stop_id):
+        return self.ring.owner(stop_id)
+
+    def owns(self, stop_id):
+        return self.owner(stop_id) == self.self_url
+
+    def http_get(self, url, params):
+        """GET JSON from a peer, with one connection pool per thread"""
+        session = getattr(self.local, "session", None)
+        if session is None:
+            import requests
+
+            session = self.local.session = requests.Session()
+        res = session.get(url, params=params, timeout=PEER_TIMEOUT_SEC)
+        res.raise_for_status()
+        return res.json()
+
+    def get_stop(self, stop_id, *, time_range):
+        """Return realtime stop information, from the owner of the stop"""
+        owner = self.owner(stop_id)
+        if owner == self.self_url:
+            return self.fetch_local(stop_id, time_range)
+
+        key = (stop_id, time_range)
+        raw = self.near_cache.get(key)
+        if raw is not None:
+            return raw
+
+        url = "{}/_cluster/stop/{}".format(owner, stop_id)
+        try:
+            res = self.request(url, dict(time_range=time_range))
+        except Exception as e:  # pylint: disable=broad-except
+            log.warning("Node %s failed, requesting stop %s: %s", owner, stop_id, e)
+            return self.fetch_local(stop_id, time_range)
+
+        # Keep it for as long as the owner keeps its copy
+        self.near_cache.put(key, res["data"], ttl=self.cache_sec - res["age"])
+        return res["data"]
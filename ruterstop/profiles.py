@@ -0,0 +1,153 @@
+"""
+Named display profiles for `--server` mode, served at `/p/<name>`.
+
+Profiles are read from a TOML file with one table per display:
+
+    [kitchen]
+    stops = [6013, 6014]
+    direction = "outbound"
+    min_eta = 2
+    long_eta = 30
+    grouped = true
+
+Options are validated and turned into format_departure_list arguments once,
+at startup. Each profile keeps its last rendered board, and reuses it until
+an ETA on it rolls over to the next minute or the cached upstream data
+expires, so most requests don't parse or format anything.
+"""
+
+import re
+from collections import namedtuple
+from datetime import timedelta
+
+import toml
+
+import ruterstop
+from ruterstop import utils
+from ruterstop.utils import seconds_until_change
+
+NAME_PATTERN = re.compile(r"^[\w-]+$")
+DIRECTIONS = ("inbound", "outbound")
+
+Rendered = namedtuple("Rendered", ["text", "expires"])
+
+
+def _stop_ids(name, value):
+    if isinstance(value, (int, str)):
+        value = str(value).split(",")
+    try:
+        stop_ids = [int(s) for s in value]
+    except (TypeError, ValueError):
+        stop_ids = []
+    if not stop_ids:
+        raise ValueError("profile {}: stops must be a list of stop IDs".format(name))
+    return stop_ids
+
+
+def _directions(name, value):
+    dirs = [value] if isinstance(value, str) else value
+    if not dirs or not all(d in DIRECTIONS for d in dirs):
+        raise ValueError(
+            "profile {}: direction must be inbound and/or outbound".format(name)
+        )
+    return frozenset(dirs)
+
+
+def _seconds_cached(stop_id):
+    """
+    Return the seconds until the cached upstream data that get_departures
+    shows for a stop expires, or None if it isn't cached.
+    """
+    kwargs = dict(stop_id=stop_id)
+    time_range = ruterstop.REALTIME_TIME_RANGE_SEC
+    timetable = ruterstop.timetable
+    in_timetable = timetable is not None and stop_id in timetable
+    if in_timetable:
+        time_range = kwargs["time_range"] = ruterstop.TIMETABLE_REALTIME_MIN * 60
+
+    cluster = ruterstop.cluster
+    if cluster is not None and not cluster.owns(stop_id):
+        return cluster.near_cache.ttl((stop_id, time_range))
+
+    entry = ruterstop.get_realtime_stop.cache_peek(**kwargs)
+    if entry is None:
+        # Timetable stops without departures near enough for realtime
+        # information are shown from the timetable alone
+        return ruterstop.REALTIME_CACHE_SEC if in_timetable else None
+    return ruterstop.REALTIME_CACHE_SEC - entry[1]
+
+
+class Profile:
+    """
+    A compiled display profile. `options` are passed on to
+    format_departure_list as they are.
+    """
+
+    def __init__(self, name, *, stop_ids, options):
+        self.name = name
+        self.stop_ids = stop_ids
+        self.options = options
+        self.rendered = None
+
+    @classmethod
+    def compile(cls, name, table):
+        if not NAME_PATTERN.match(name) or not isinstance(table, dict):
+            raise ValueError("invalid profile: " + name)
+
+        table = dict(table)
+        stop_ids = _stop_ids(name, table.pop("stops", None))
+        options = {}
+        for key, value in table.items():
+            if key == "direction":
+                options["directions"] = _directions(name, value)
+            elif key in ("min_eta", "long_eta"):
+                if isinstance(value, bool) or not isinstance(value, int):
+                    raise ValueError(
+                        "profile {}: {} must be a number".format(name, key)
+                    )
+                options[key] = value
+            elif key == "grouped":
+                options["grouped"] = bool(value)
+            else:
+                raise ValueError("profile {}: unknown option {}".format(name, key))
+        return cls(name, stop_ids=stop_ids, options=options)
+
+    def data_expires(self, now):
+        """
+        Return when the cached upstream data of the profile's stops expires,
+        or `now` if any of them can't be looked up in the cache. Stops from a
+        --timetable and from other nodes in a cluster are looked up where
+        get_departures got them.
+        """
+        left = ruterstop.REALTIME_CACHE_SEC
+        for stop_id in self.stop_ids:
+            secs = _seconds_cached(stop_id)
+            if secs is None:
+                return now
+            left = min(left, secs)
+        return now + timedelta(seconds=left)
+
+    def render(self, *, now=None):
+        """Return the formatted board, from the render cache if it is still valid"""
+        now = now or utils.now()
+        if self.rendered is not None and now < self.rendered.expires:
+            return self.rendered.text
+
+        deps = list(ruterstop.get_merged_departures(stop_ids=self.stop_ids, now=now))
+        text = ruterstop.format_departure_list(deps, now=now, **self.options)
+
+        expires = self.data_expires(now)
+        change = seconds_until_change(deps, now)
+        if change is not None:
+            expires = min(expires, now + timedelta(seconds=change))
+        self.rendered = Rendered(text, expires)
+        return text
+
+
+def load_profiles(path):
+    """Read and compile the profiles in a TOML file into a dict by name"""
+    try:
+        config = toml.load(path)
+    except toml.TomlDecodeError as e:
+        raise ValueError("invalid profiles file {}: {}".format(path, e))
+    return {name: Profile.compile(name, table) for name, table in config.items()}
@@ -0,0 +1,312 @@
+"""
+HTTP server for `--server` mode.
+
+Kept out of the package root so that one-shot CLI invocations don't import
+bottle. `ruterstop.webapp` imports this module on first access.
+"""
+
+import logging
+import signal
+import sys
+import threading
+from datetime import timedelta
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIServer
+
+import bottle
+
+import ruterstop
+from ruterstop import utils
+from ruterstop.updates import DeltaLog, format_delta
+
+webapp = bottle.Bottle()
+log = logging.getLogger("ruterstop")
+
+
+def not_found_error_handler(res):
+    res.set_header("Content-Type", "text/plain")
+    return "Ugyldig stoppested"
+
+
+webapp.error(code=404)(not_found_error_handler)
+
+
+def default_error_handler(res):
+    res.set_header("Content-Type", "text/plain")
+    log.error(res.traceback)
+    return "Feil på serveren"
+
+
+webapp.default_error_handler = default_error_handler
+
+
+# Most stops accepted in one request, e.g. /6013,6014
+MAX_STOPS = 10
+
+# Requests per stop and hour of day, counted when warmup is enabled
+popularity = None
+
+# Display profiles by name, loaded with --profiles
+profiles = {}
+
+# Recent versions of each stop's departures, for delta updates
+delta_logs = {}
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    """A wsgiref server that handles each request in its own thread"""
+
+    daemon_threads = True
+
+
+def track(stop_ids):
+    if popularity is not None:
+        for stop_id in stop_ids:
+            popularity.record(stop_id)
+
+
+def format_kwargs(q):
+    """
+    Turn whitelisted querystring values into kwargs for format_departure_list.
+    """
+    kw = dict()
+
+    if q.direction:
+        kw["directions"] = q.direction
+    if q.min_eta:
+        kw["min_eta"] = int(q.min_eta)
+    if q.grouped:
+        kw["grouped"] = True
+    if q.long_eta:
+        kw["long_eta"] = int(q.long_eta)
+    return kw
+
+
+@webapp.route("/<stop_id:int>")
+def serve_departures(stop_id):
+    """
+    Responds to web requests with the departures of a single stop.
+    """
+    track([stop_id])
+    kw = format_kwargs(bottle.request.query)
+    now = utils.now()
+    deps = ruterstop.get_departures(stop_id=stop_id, now=now)
+    bottle.response.set_header("Content-Type", "text/plain")
+    return ruterstop.format_departure_list(deps, now=now, **kw)
+
+
+@webapp.route("/<stop_id:int>/delta")
+def serve_delta(stop_id):
+    """
+    Responds to web requests with the changes to a stop's departures since
+    the version in `since`, or all of them. See ruterstop.updates.
+    """
+    q = bottle.request.query
+    since = int(q.since) if q.since.isdigit() else None
+
+    track([stop_id])
+    now = utils.now()
+    deps = ruterstop.get_departures(stop_id=stop_id, now=now)
+    versions = delta_logs.setdefault(stop_id, DeltaLog())
+    versions.update(deps)
+
+    bottle.response.set_header("Content-Type", "text/plain")
+    changes = versions.changes(since, directions=q.direction or None)
+    return format_delta(*changes, now=now)
+
+
+@webapp.route(r"/<stop_ids:re:\d+(?:,\d+)+>")
+def serve_merged_departures(stop_ids):
+    """
+    Responds to web requests for a comma separated list of stops with their
+    departures merged into one board.
+    """
+    stop_ids = [int(s) for s in stop_ids.split(",")]
+    if len(stop_ids) > MAX_STOPS:
+        return bottle.HTTPResponse(
+            "For mange stoppesteder", status=400, **{"Content-Type": "text/plain"}
+        )
+
+    track(stop_ids)
+    kw = format_kwargs(bottle.request.query)
+    now = utils.now()
+    deps = ruterstop.get_merged_departures(stop_ids=stop_ids, now=now)
+    bottle.response.set_header("Content-Type", "text/plain")
+    return ruterstop.format_departure_list(deps, now=now, **kw)
+
+
+@webapp.route(r"/p/<name:re:[\w-]+>")
+def serve_profile(name):
+    """
+    Responds to web requests with the board of a named display profile.
+    """
+    profile = profiles.get(name)
+    if profile is None:
+        return bottle.HTTPResponse(
+            "Ukjent profil", status=404, **{"Content-Type": "text/plain"}
+        )
+
+    track(profile.stop_ids)
+    bottle.response.set_header("Content-Type", "text/plain")
+    return profile.render(now=utils.now())
+
+
+def fetch_stop(stop_id):
+    """Fill the cache for a stop"""
+    list(ruterstop.get_departures(stop_id=stop_id))
+
+
+def restore_state(path):
+    """
+    Load saved popularity counts, and put saved payloads that are still fresh
+    back in the cache. Returns the stop IDs that were restored.
+    """
+    from ruterstop.warmup import load_state
+
+    global popularity  # pylint: disable=global-statement
+    popularity, payloads = load_state(path)
+
+    now = utils.now()
+    restored = set()
+    for stop_id, payload, fetched in payloads:
+        age = (now - fetched).total_seconds()
+        # A negative age means the clock went back since the payload was saved
+        if 0 <= age < ruterstop.REALTIME_CACHE_SEC:
+            ruterstop.get_realtime_stop.cache_prime(payload, age, stop_id=stop_id)
+            restored.add(stop_id)
+    log.info("Restored %d of %d saved stops", len(restored), len(payloads))
+    return restored
+
+
+def save_state(path):
+    """Save popularity counts and the cached payloads of the hot set"""
+    from ruterstop.warmup import save_state as save
+
+    now = utils.now()
+    payloads = []
+    for stop_id in popularity.hot(now.hour):
+        entry = ruterstop.get_realtime_stop.cache_peek(stop_id=stop_id)
+        if entry:
+            payload, age = entry
+            payloads.append((stop_id, payload, now - timedelta(seconds=age)))
+    save(path, popularity=popularity, payloads=payloads)
+    log.info("Saved warmup state to %s", path)
+
+
+def start_warmup(*, state_file=None, prewarm_at=None):
+    """
+    Restore saved state and warm the hot set in the background, and schedule
+    pre-warming before the `prewarm_at` times of day.
+    """
+    from ruterstop.warmup import Popularity, Warmer
+
+    global popularity  # pylint: disable=global-statement
+    popularity = Popularity()
+    restored = restore_state(state_file) if state_file else set()
+    warmer = Warmer(fetch_stop, popularity=popularity)
+
+    if state_file:
+        threading.Thread(
+            target=warmer.warm_hot, kwargs=dict(skip=restored), daemon=True
+        ).start()
+
+    if prewarm_at:
+        threading.Thread(
+            target=warmer.run_schedule,
+            args=(prewarm_at,),
+            kwargs=dict(lead_sec=ruterstop.REALTIME_CACHE_SEC),
+            daemon=True,
+        ).start()
+    return warmer
+
+
+# Time ranges nodes in a cluster request stops with, by get_departures and
+# get_timetable_departures. Each range is a cache entry and an upstream call,
+# so no others are served.
+CLUSTER_TIME_RANGES = (
+    ruterstop.REALTIME_TIME_RANGE_SEC,
+    ruterstop.TIMETABLE_REALTIME_MIN * 60,
+)
+
+
+def get_cached_stop(stop_id, time_range):
+    """
+    Return a stop's realtime information through this node's cache, and how
+    many seconds ago it was fetched.
+    """
+    kwargs = dict(stop_id=stop_id)
+    # Share cache entries with get_departures, which leaves out the default
+    if time_range != ruterstop.REALTIME_TIME_RANGE_SEC:
+        kwargs["time_range"] = time_range
+
+    raw = ruterstop.get_realtime_stop(**kwargs)
+    entry = ruterstop.get_realtime_stop.cache_peek(**kwargs)
+    return raw, entry[1] if entry else 0
+
+
+@webapp.route("/_cluster/stop/<stop_id:int>")
+def serve_cluster_stop(stop_id):
+    """
+    Responds to other nodes in the cluster with the realtime information of
+    a stop this node owns, and its age in seconds. Not found unless this node
+    is in a cluster.
+    """
+    if ruterstop.cluster is None:
+        bottle.abort(404)
+
+    q = bottle.request.query
+    time_range = ruterstop.REALTIME_TIME_RANGE_SEC
+    if q.time_range:
+        time_range = int(q.time_range) if q.time_range.isdigit() else None
+    if time_range not in CLUSTER_TIME_RANGES:
+        return bottle.HTTPResponse(
+            "Ugyldig tidsrom", status=400, **{"Content-Type": "text/plain"}
+        )
+
+    raw, age = get_cached_stop(stop_id, time_range)
+    return dict(data=raw, age=age)
+
+
+def make_cluster(*, nodes, self_url):
+    """Return this node's Cluster, for ruterstop.cluster"""
+    from ruterstop.peers import Cluster
+
+    if not self_url:
+        raise ValueError("--cluster-self is required with --cluster-nodes")
+
+    cluster = Cluster(
+        nodes=[n.strip() for n in nodes if n.strip()],
+        self_url=self_url,
+        fetch_local=lambda stop_id, time_range: get_cached_stop(stop_id, time_range)[0],
+        cache_sec=ruterstop.REALTIME_CACHE_SEC,
+    )
+    return cluster
+
+
+def run(*, host, port, debug_token=None, state_file=None, prewarm_at=None):
+    """
+    Start the HTTP server, with debug routes if a token is given. Warmup
+    state is saved to `state_file` on shutdown, also when stopped by SIGTERM.
+    """
+    if debug_token:
+        from ruterstop.debug import install_debug_routes
+
+        install_debug_routes(webapp, token=debug_token)
+
+    if state_file or prewarm_at:
+        start_warmup(state_file=state_file, prewarm_at=prewarm_at)
+    if state_file:
+        sigterm = signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+    options = {}
+    if ruterstop.cluster is not None:
+        # Nodes request stops from each other, so each must keep serving
+        # while it waits for another
+        options["server_class"] = ThreadingWSGIServer
+
+    try:
+        bottle.run(webapp, host=host, port=port, **options)
+    finally:
+        if state_file:
+            signal.signal(signal.SIGTERM, sigterm)
+            save_state(state_file)
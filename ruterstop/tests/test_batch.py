@@ -0,0 +1,71 @@
+import random
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+import ruterstop
+from ruterstop.batch import ETA_STRINGS, BatchRenderer, format_departure_lists
+from ruterstop.utils import human_delta
+
+NOW = datetime(2021, 5, 10, 8, 0, 12, 345678)
+
+OPTIONS = [
+    dict(),
+    dict(min_eta=3),
+    dict(long_eta=10),
+    dict(long_eta=-1),
+    dict(directions="inbound", grouped=True),
+    dict(directions=["outbound"], grouped=True, min_eta=1, long_eta=30),
+    dict(grouped=True, long_eta=200),
+]
+
+
+def random_departures(rnd, count):
+    deps = []
+    for _ in range(count):
+        # From a few minutes ago to more than a day ahead, on and off whole
+        # minutes and seconds
+        secs = rnd.choice([rnd.randint(-300, 7200), rnd.randint(0, 100000)])
+        eta = NOW + timedelta(seconds=secs, microseconds=rnd.choice([0, 654322]))
+        deps.append(
+            ruterstop.Departure(
+                line=rnd.choice(["31", "25", "5", "110E"]),
+                name=rnd.choice(["Snaroeya", "Majorstuen", "Baerums verk", ""]),
+                eta=eta,
+                direction=rnd.choice(["inbound", "outbound", "unknown"]),
+                realtime=rnd.random() < 0.7,
+                id=rnd.choice([None, "RUT:ServiceJourney:1"]),
+            )
+        )
+    deps.sort(key=lambda d: d.eta)
+    return deps
+
+
+class BatchRendererTestCase(TestCase):
+    def test_eta_strings(self):
+        for mins in range(100):
+            eta = NOW + timedelta(minutes=mins, seconds=1)
+            self.assertEqual(ETA_STRINGS[mins], " " + human_delta(eta, since=NOW))
+
+    def test_identical_to_format_departure_list(self):
+        rnd = random.Random(1)
+        jobs = [
+            (random_departures(rnd, rnd.randint(0, 40)), rnd.choice(OPTIONS))
+            for _ in range(300)
+        ]
+
+        expected = [ruterstop.format_departure_list(d, now=NOW, **o) for d, o in jobs]
+        self.assertEqual(format_departure_lists(jobs, now=NOW), expected)
+
+    def test_reuses_work_between_boards(self):
+        deps = random_departures(random.Random(2), 20)
+        renderer = BatchRenderer(NOW)
+        for options in OPTIONS:
+            renderer.render(deps, **options)
+        self.assertLessEqual(len(renderer.minutes), 20)
+        # Rows are formatted once per departure or group and ETA style: 20
+        # departures in two styles, and a few grouped rows
+        self.assertLessEqual(len(renderer.rendered), 50)
+        rendered = dict(renderer.rendered)
+        for options in OPTIONS:
+            renderer.render(deps, **options)
+        self.assertEqual(renderer.rendered, rendered)
@@ -1,12 +1,13 @@
 import json
 import os
+import subprocess
+import sys
 from io import StringIO
 from unittest import TestCase
 from unittest.mock import patch
 
-from freezegun import freeze_time
-
 import ruterstop
+from ruterstop.utils import FakeClock
 
 
 def run(args):
@@ -53,7 +54,7 @@ class CommandLineInterfaceTestCase(TestCase):
             p.stop()
 
     def test_simple_output(self):
-        with freeze_time(self.first_departure_time):
+        with FakeClock(self.first_departure_time):
             # Call CLI with custom args
             out = run(["--stop-id", "1337"])
             self.patched_get_realtime_stop.assert_called_once_with(stop_id="1337")
@@ -61,15 +62,25 @@ class CommandLineInterfaceTestCase(TestCase):
             actual = filter(None, out)  # remove empty lines
             self.assertEqual(list(actual), self.expected_output)
 
+    def test_multiple_stops(self):
+        with FakeClock(self.first_departure_time):
+            out = run(["--stop-id", "1337,1338"])
+            self.assertEqual(self.patched_get_realtime_stop.call_count, 2)
+
+            # The same departures twice, merged in ETA order
+            actual = list(filter(None, out))
+            self.assertEqual(sorted(actual), sorted(self.expected_output * 2))
+            self.assertEqual(actual[-2:], self.expected_output[-1:] * 2)
+
     def test_adjustable_minimum_time(self):
-        with freeze_time(self.first_departure_time):
+        with FakeClock(self.first_departure_time):
             # Call CLI with custom args
             out = run(["--stop-id", "1337", "--min-eta", "2"])
             lines = filter(None, out)  # remove empty lines
             self.assertEqual(list(lines), self.expected_output[3:])  # skip first 3
 
     def test_direction_arg_is_accounted_for(self):
-        with freeze_time(self.first_departure_time):
+        with FakeClock(self.first_departure_time):
             out = run(["--stop-id", "1337", "--direction", "outbound"])
             self.assertNotIn("Tonsenhagen", out)
 
@@ -81,3 +92,21 @@ class CommandLineInterfaceTestCase(TestCase):
             out = run(["--search-stop", "foobar"])
             out = filter(None, out)  # remove empty lines
             self.assertEqual(len(list(out)), 5)
+
+    def test_import_does_not_load_server_or_http_client(self):
+        modules = ("argparse", "bottle", "requests")
+        if sys.version_info < (3, 7):
+            # No module __getattr__, so the server is imported up front
+            modules = ("argparse", "requests")
+        code = (
+            "import sys, ruterstop; "
+            "print(sorted(m for m in {!r} if m in sys.modules))".format(modules)
+        )
+        out = subprocess.run(
+            [sys.executable, "-c", code],
+            check=True,
+            cwd=os.path.dirname(os.path.dirname(ruterstop.__file__)),
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout
+        self.assertEqual(out.strip(), "[]")
@@ -0,0 +1,92 @@
+import tracemalloc
+from unittest import TestCase
+from unittest.mock import patch
+
+import bottle
+from webtest import TestApp
+
+from ruterstop.debug import ProfileSession, install_debug_routes
+
+TOKEN = "s3cret"
+AUTH = {"Authorization": "Bearer " + TOKEN}
+
+
+class DebugRoutesTestCase(TestCase):
+    def setUp(self):
+        app = bottle.Bottle()
+
+        @app.route("/<stop_id:int>")
+        def work(stop_id):
+            return str(sum(range(stop_id)))
+
+        self.plugin, self.tracer = install_debug_routes(app, token=TOKEN)
+        self.app = TestApp(app)
+
+    def tearDown(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def test_requires_token(self):
+        res = self.app.get("/debug/profile", expect_errors=True)
+        self.assertEqual(res.status_code, 401)
+
+        wrong = {"Authorization": "Bearer wrong"}
+        res = self.app.get("/debug/profile", headers=wrong, expect_errors=True)
+        self.assertEqual(res.status_code, 401)
+
+        # Never from the querystring, which is logged
+        res = self.app.get("/debug/profile?token=" + TOKEN, expect_errors=True)
+        self.assertEqual(res.status_code, 401)
+
+        res = self.app.get("/debug/profile", headers=AUTH, expect_errors=True)
+        self.assertEqual(res.status_code, 404)
+
+    def test_refuses_empty_token(self):
+        with self.assertRaises(ValueError):
+            install_debug_routes(bottle.Bottle(), token="")
+
+    def test_profiles_limited_number_of_requests(self):
+        res = self.app.post("/debug/profile", expect_errors=True, headers=AUTH)
+        self.assertEqual(res.status_code, 400)
+
+        self.app.post("/debug/profile?requests=2", headers=AUTH)
+        for _ in range(3):
+            self.app.get("/1000")
+
+        self.assertEqual(self.plugin.session.requests, 2)
+        res = self.app.get("/debug/profile?sort=tottime&limit=5", headers=AUTH)
+        self.assertIn("status: done, requests: 2", res.text)
+        self.assertIn("function calls", res.text)
+
+    def test_profile_session_expires_after_seconds(self):
+        clock = iter([0, 5, 11]).__next__
+        session = ProfileSession(seconds=10, clock=clock)
+        self.assertFalse(session.done)
+        self.assertTrue(session.done)
+
+    def test_not_installed_routes_are_not_wrapped(self):
+        app = bottle.Bottle()
+        res = TestApp(app).get("/debug/profile", expect_errors=True)
+        self.assertEqual(res.status_code, 404)
+
+    def test_tracemalloc_diff(self):
+        res = self.app.get("/debug/tracemalloc", headers=AUTH, expect_errors=True)
+        self.assertEqual(res.status_code, 404)
+
+        self.app.post("/debug/tracemalloc", headers=AUTH)
+        self.assertTrue(tracemalloc.is_tracing())
+
+        res = self.app.get("/debug/tracemalloc?limit=5", headers=AUTH)
+        self.assertRegex(res.text, r"^traced: \d+ B, peak: \d+ B")
+
+        self.app.delete("/debug/tracemalloc", headers=AUTH)
+        self.assertFalse(tracemalloc.is_tracing())
+
+    @patch("bottle.run")
+    def test_cli_installs_routes_with_token(self, run_mock):
+        import ruterstop
+
+        with patch("ruterstop.debug.install_debug_routes") as install_mock:
+            ruterstop.main(["TEST", "--server", "--debug-token", TOKEN])
+            install_mock.assert_called_once_with(ruterstop.webapp, token=TOKEN)
+        self.assertEqual(run_mock.call_count, 1)
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import threading
+import time
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import ruterstop
+from ruterstop.diskcache import HEADER, DiskCache, default_cache_dir
+
+
+class DiskCacheTestCase(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = os.path.join(self.tmp.name, "ruterstop")
+        self.now = Mock(return_value=1000.0)
+        self.cache = DiskCache(self.dir, ttl=30, clock=self.now)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip_and_expiry(self):
+        self.assertIsNone(self.cache.read("stop-1"))
+
+        self.cache.write("stop-1", dict(data=[1, "ø"]))
+        self.assertEqual(self.cache.read("stop-1"), dict(data=[1, "ø"]))
+
+        self.now.return_value = 1029.9
+        self.assertIsNotNone(self.cache.read("stop-1"))
+        self.now.return_value = 1030.0
+        self.assertIsNone(self.cache.read("stop-1"))
+
+        # Entries from the future are not trusted either
+        self.now.return_value = 999.0
+        self.assertIsNone(self.cache.read("stop-1"))
+
+    def test_corrupt_entries_are_misses(self):
+        os.makedirs(self.dir)
+        for content in [b"", b"RST1", b"XXXX" + b"\0" * HEADER.size]:
+            with open(self.cache.path("stop-1"), "wb") as fp:
+                fp.write(content)
+            self.assertIsNone(self.cache.read("stop-1"))
+
+        # Truncated payload
+        self.cache.write("stop-1", dict(a=1))
+        with open(self.cache.path("stop-1"), "r+b") as fp:
+            fp.truncate(HEADER.size + 2)
+        self.assertIsNone(self.cache.read("stop-1"))
+
+    def test_keys_stay_in_directory(self):
+        path = self.cache.path("../../etc/passwd")
+        self.assertEqual(os.path.dirname(path), self.dir)
+
+    def test_get_fetches_once_per_ttl(self):
+        fetch = Mock(return_value=dict(a=1))
+        self.assertEqual(self.cache.get("k", fetch), dict(a=1))
+        self.assertEqual(self.cache.get("k", fetch), dict(a=1))
+        self.assertEqual(fetch.call_count, 1)
+
+        self.now.return_value += 30
+        self.cache.get("k", fetch)
+        self.assertEqual(fetch.call_count, 2)
+
+    def test_concurrent_gets_share_one_fetch(self):
+        cache = DiskCache(self.dir, ttl=30)
+        fetch = Mock(side_effect=lambda: time.sleep(0.05) or dict(a=1))
+        results = []
+
+        def worker():
+            # Separate instances, like separate processes
+            results.append(DiskCache(self.dir, ttl=30).get("k", fetch))
+
+        threads = [threading.Thread(target=worker) for _ in range(5)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(fetch.call_count, 1)
+        self.assertEqual(results, [dict(a=1)] * 5)
+        self.assertEqual(cache.read("k"), dict(a=1))
+
+    def test_fetch_errors_are_not_cached(self):
+        fetch = Mock(side_effect=IOError("upstream down"))
+        with self.assertRaises(IOError):
+            self.cache.get("k", fetch)
+        self.assertIsNone(self.cache.read("k"))
+
+    def test_unwritable_directory_still_fetches(self):
+        cache = DiskCache(os.path.join(self.tmp.name, "file", "dir"), clock=self.now)
+        with open(os.path.join(self.tmp.name, "file"), "w"):
+            pass
+        with self.assertLogs(logger="ruterstop", level="WARNING"):
+            self.assertEqual(cache.get("k", lambda: 1), 1)
+
+    def test_default_cache_dir(self):
+        with patch.dict(os.environ, XDG_CACHE_HOME="/xdg"):
+            self.assertEqual(default_cache_dir(), "/xdg/ruterstop")
+
+    def test_cli_uses_disk_cache(self):
+        raw = dict(data=dict(stopPlace=None))
+        with patch("ruterstop.request_realtime_stop", return_value=raw) as mock:
+            try:
+                for stop_id in ["1", "1", "2"]:
+                    args = ["TEST", "--disk-cache", "--cache-dir", self.dir]
+                    ruterstop.main(args + ["--stop-id", stop_id], stdout=StringIO())
+                    ruterstop.get_realtime_stop.cache_clear()
+            finally:
+                ruterstop.disk_cache = None
+
+        self.assertEqual(mock.call_count, 2)
+        self.assertTrue(os.path.exists(os.path.join(self.dir, "stop-1-72100")))
@@ -0,0 +1,145 @@
+import json
+import os
+import random
+import threading
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from webtest import TestApp
+
+import ruterstop
+from ruterstop import fakeentur
+from ruterstop.fakeentur import FakeEnTur, parse_latency
+
+
+def query(stop_id, time_range=72100):
+    return dict(
+        query=ruterstop.ENTUR_GRAPHQL_QUERY
+        % dict(stop_id=stop_id, time_range=time_range, count=20)
+    )
+
+
+class ParseLatencyTestCase(TestCase):
+    def test_distributions(self):
+        rnd = random.Random(0)
+        self.assertEqual(parse_latency("50")(rnd), 0.05)
+        self.assertEqual(parse_latency("fixed:0")(rnd), 0)
+        self.assertTrue(0.02 <= parse_latency("uniform:20:200")(rnd) <= 0.2)
+        self.assertGreaterEqual(parse_latency("normal:0:100")(rnd), 0)
+        self.assertGreater(parse_latency("lognormal:80:0.5")(rnd), 0)
+        self.assertGreaterEqual(parse_latency("exp:100")(rnd), 0)
+
+    def test_invalid_spec(self):
+        for spec in ["", "uniform:1", "gamma:1:2", "fixed:abc"]:
+            with self.assertRaises(ValueError, msg=spec):
+                parse_latency(spec)
+
+
+class SyntheticDeparturesTestCase(TestCase):
+    def test_parses_as_departures(self):
+        now = datetime(2021, 3, 1, 8, 0, 0)
+        raw = fakeentur.synthetic_departures(6013, 40, now=now)
+        deps = list(ruterstop.parse_departures(raw))
+
+        self.assertEqual(len(deps), 40)
+        self.assertEqual(deps, sorted(deps, key=lambda d: d.eta))
+        self.assertGreater(deps[0].eta, now)
+        self.assertIn(deps[0].direction, ("inbound", "outbound"))
+
+    def test_etas_are_stable_over_time(self):
+        now = datetime(2021, 3, 1, 8, 0, 0)
+        first = fakeentur.synthetic_departures(6013, 10, now=now)
+        later = fakeentur.synthetic_departures(6013, 10, now=now + timedelta(minutes=1))
+        first_etas = [
+            c["expectedArrivalTime"]
+            for c in first["data"]["stopPlace"]["estimatedCalls"]
+        ]
+        later_etas = [
+            c["expectedArrivalTime"]
+            for c in later["data"]["stopPlace"]["estimatedCalls"]
+        ]
+        self.assertTrue(set(later_etas) & set(first_etas))
+
+    def test_shift_recording(self):
+        p = os.path.realpath(os.path.dirname(__file__))
+        with open(os.path.join(p, "test_data.json")) as fp:
+            raw = json.load(fp)
+
+        now = datetime(2021, 3, 1, 8, 0, 0)
+        deps = list(
+            ruterstop.parse_departures(fakeentur.shift_departures(raw, now=now))
+        )
+        self.assertEqual(deps[0].eta, now)
+        self.assertEqual(deps[3].eta - deps[0].eta, timedelta(minutes=5, seconds=19))
+
+
+class FakeEnTurTestCase(TestCase):
+    def test_serves_departures_and_counts_calls(self):
+        fake = FakeEnTur(departures=7)
+        app = TestApp(fake.app)
+
+        res = app.post_json(fakeentur.JOURNEY_PLANNER_PATH, query(6013))
+        self.assertEqual(len(res.json["data"]["stopPlace"]["estimatedCalls"]), 7)
+        app.post_json(fakeentur.JOURNEY_PLANNER_PATH, query(6013))
+        app.post_json(fakeentur.JOURNEY_PLANNER_PATH, query(1234))
+
+        stats = app.get("/_stats").json
+        self.assertEqual(stats["calls"], dict(journey_planner=3))
+        self.assertEqual(stats["stops"], {"6013": 2, "1234": 1})
+
+        # Only departures within the time range of the query
+        res = app.post_json(fakeentur.JOURNEY_PLANNER_PATH, query(6013, 60))
+        self.assertLess(len(res.json["data"]["stopPlace"]["estimatedCalls"]), 7)
+
+        app.post("/_reset")
+        self.assertEqual(app.get("/_stats").json["calls"], {})
+
+    def test_stop_search(self):
+        fake = FakeEnTur()
+        res = TestApp(fake.app).post_json(
+            fakeentur.STOP_PLACE_PATH,
+            dict(query=ruterstop.ENTUR_STOP_PLACE_QUERY % dict(stop_name="stig")),
+        )
+        stops = list(ruterstop.parse_stops(res.json))
+        self.assertEqual(len(stops), 5)
+        self.assertEqual(stops[0].name, "Stig")
+
+    def test_latency_and_errors(self):
+        sleep = Mock()
+        fake = FakeEnTur(latency="25", error_rate=1.0, error_status=503, sleep=sleep)
+        res = TestApp(fake.app).post_json(
+            fakeentur.JOURNEY_PLANNER_PATH, query(6013), expect_errors=True
+        )
+        self.assertEqual(res.status_code, 503)
+        sleep.assert_called_once_with(0.025)
+        self.assertEqual(fake.stats()["errors"], 1)
+
+    def test_serves_recordings(self):
+        recording = fakeentur.synthetic_departures(1, 3)
+        fake = FakeEnTur(recordings={"6013": recording})
+        app = TestApp(fake.app)
+
+        res = app.post_json(fakeentur.JOURNEY_PLANNER_PATH, query(6013))
+        self.assertEqual(res.json["data"]["stopPlace"]["id"], "NSR:StopPlace:1")
+        res = app.post_json(fakeentur.JOURNEY_PLANNER_PATH, query(6014))
+        self.assertEqual(res.json["data"]["stopPlace"]["id"], "NSR:StopPlace:6014")
+
+    def test_cli_against_fake_server(self):
+        fake = FakeEnTur(departures=5)
+        httpd = fakeentur.make_fake_server(fake)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        url = "http://127.0.0.1:{}{}".format(
+            httpd.server_port, fakeentur.JOURNEY_PLANNER_PATH
+        )
+        try:
+            with patch("ruterstop.ENTUR_GRAPHQL_ENDPOINT", url):
+                out = StringIO()
+                ruterstop.main(["TEST", "--stop-id", "987654"], stdout=out)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+        self.assertEqual(len(list(filter(None, out.getvalue().split("\n")))), 5)
+        self.assertEqual(fake.stats()["stops"], {"987654": 1})
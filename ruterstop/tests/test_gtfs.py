@@ -0,0 +1,185 @@
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import patch
+
+import ruterstop
+from ruterstop.gtfs import Timetable, compile_gtfs
+from ruterstop.utils import FakeClock
+
+FEED = os.path.join(os.path.dirname(__file__), "test_gtfs_feed")
+
+# A Monday, a Saturday and a Monday holiday with the weekend schedule
+WEEKDAY = datetime(2021, 5, 10, 7, 0)
+SATURDAY = datetime(2021, 5, 15, 7, 0)
+HOLIDAY = datetime(2021, 5, 17, 7, 0)
+
+# A Thursday with an extra trip that has no direction_id
+EXTRA_DAY = datetime(2021, 5, 20, 8, 30)
+
+
+def summary(deps):
+    return [(d.line, d.name, d.eta.strftime("%d %H:%M"), d.direction) for d in deps]
+
+
+class CompileTestCase(TestCase):
+    def setUp(self):
+        self.table = compile_gtfs(FEED)
+
+    def test_folds_quays_into_stop_places(self):
+        self.assertIn(6013, self.table)
+        self.assertIn("6014", self.table)
+        self.assertIn("6015", self.table)
+        self.assertNotIn("11001", self.table)
+        self.assertNotIn("11201", self.table)
+
+        # Last stops of trips, where nobody boards, are left out
+        self.assertEqual(len(self.table), 10)
+
+    def test_weekday_departures(self):
+        deps = self.table.departures(6013, since=WEEKDAY)
+        self.assertEqual(
+            summary(deps),
+            [
+                ("31", "Snaroeya", "10 08:00", "outbound"),
+                ("31", "Snaroeya", "10 08:30", "outbound"),
+                ("31", "Snaroeya", "10 23:50", "outbound"),
+            ],
+        )
+        self.assertFalse(any(d.realtime for d in deps))
+
+    def test_headsigns_and_directions(self):
+        deps = self.table.departures(6014, since=WEEKDAY, count=3)
+        self.assertEqual(
+            summary(deps),
+            [
+                ("31", "Snaroeya", "10 08:05", "outbound"),
+                ("31", "Tonsenhagen", "10 08:22", "inbound"),
+                ("31", "Fornebu", "10 08:35", "outbound"),
+            ],
+        )
+
+    def test_quays_without_stop_place_keep_their_id(self):
+        # Not mixed up with the stop place of the same number
+        self.assertIn("NSR:Quay:6013", self.table)
+        deps = self.table.departures(
+            6013, since=EXTRA_DAY, until=EXTRA_DAY.replace(hour=9)
+        )
+        self.assertEqual(summary(deps), [("31", "Snaroeya", "20 08:30", "outbound")])
+
+    def test_trips_without_direction_are_shown(self):
+        deps = self.table.departures("NSR:Quay:6013", since=EXTRA_DAY, count=1)
+        self.assertEqual(summary(deps), [("25", "Loerenskog", "20 08:45", "unknown")])
+        self.assertEqual(
+            ruterstop.format_departure_list(deps, now=EXTRA_DAY),
+            "25 Loerenskog  15 min\n",
+        )
+
+    def test_weekend_and_calendar_exceptions(self):
+        for day in [SATURDAY, HOLIDAY]:
+            deps = self.table.departures(6013, since=day, until=day.replace(hour=23))
+            self.assertEqual(
+                summary(deps),
+                [("25", "Majorstuen", day.strftime("%d 09:00"), "outbound")],
+            )
+
+    def test_departures_past_midnight(self):
+        # The 23:50 weekday trip reaches Ulven at 24:05 on the Monday service day
+        since = datetime(2021, 5, 11, 0, 0)
+        deps = self.table.departures(6014, since=since, count=1)
+        self.assertEqual(summary(deps), [("31", "Snaroeya", "11 00:05", "outbound")])
+
+        # Sundays have no late trip
+        since = datetime(2021, 5, 17, 0, 0)
+        deps = self.table.departures(6014, since=since, count=1)
+        self.assertEqual(deps, [])
+
+    def test_limited_to_stops(self):
+        table = compile_gtfs(FEED, stop_ids=["6014"])
+        self.assertEqual(list(table.stops), ["6014"])
+
+    def test_zip_feed_and_roundtrip(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            feed = shutil.make_archive(os.path.join(tmp, "gtfs"), "zip", FEED)
+            table = compile_gtfs(feed)
+            path = os.path.join(tmp, "timetable.bin")
+            table.save(path)
+            loaded = Timetable.load(path)
+
+            with self.assertRaises(ValueError):
+                Timetable.load(feed)
+
+        for stop in ["6013", "6014", "6015"]:
+            self.assertEqual(
+                loaded.departures(stop, since=WEEKDAY),
+                self.table.departures(stop, since=WEEKDAY),
+            )
+
+
+class TimetableDeparturesTestCase(TestCase):
+    def setUp(self):
+        ruterstop.timetable = compile_gtfs(FEED)
+
+    def tearDown(self):
+        ruterstop.timetable = None
+
+    @patch("ruterstop.get_realtime_stop")
+    def test_no_upstream_call_without_near_departures(self, realtime_mock):
+        deps = ruterstop.get_timetable_departures(stop_id="6013", now=WEEKDAY)
+        self.assertEqual(len(list(deps)), 3)
+        realtime_mock.assert_not_called()
+
+    @patch("ruterstop.parse_departures")
+    @patch("ruterstop.get_realtime_stop")
+    def test_merges_realtime_and_planned(self, realtime_mock, parse_mock):
+        now = WEEKDAY.replace(hour=7, minute=45)
+        realtime = ruterstop.Departure(
+            "31", "Snaroeya", now.replace(hour=8, minute=2), "outbound", True
+        )
+        parse_mock.return_value = iter([realtime])
+
+        deps = list(ruterstop.get_timetable_departures(stop_id="6013", now=now))
+
+        realtime_mock.assert_called_once_with(stop_id="6013", time_range=59 * 60)
+        self.assertEqual(deps[0], realtime)
+        # Planned 08:00 and 08:30 are within the realtime window
+        self.assertEqual(
+            summary(deps[1:]), [("31", "Snaroeya", "10 23:50", "outbound")]
+        )
+
+    @patch("ruterstop.get_realtime_stop")
+    def test_unknown_stops_use_realtime(self, realtime_mock):
+        realtime_mock.return_value = dict(data=dict(stopPlace=None))
+        self.assertEqual(list(ruterstop.get_departures(stop_id="1234")), [])
+        realtime_mock.assert_called_once_with(stop_id="1234")
+
+
+class TimetableCLITestCase(TestCase):
+    def test_import_and_use_timetable(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "timetable.bin")
+            out = StringIO()
+            args = ["TEST", "--import-timetable", FEED, "--timetable", path]
+            ruterstop.main(args + ["--stop-id", "6013, 6014"], stdout=out)
+            self.assertEqual(out.getvalue(), "Imported 8 departures from 2 stops\n")
+
+            patch_departures = patch(
+                "ruterstop.get_timetable_departures", return_value=[]
+            )
+            with patch_departures as mock, FakeClock(WEEKDAY):
+                try:
+                    ruterstop.main(
+                        ["TEST", "--timetable", path, "--stop-id", "6013"],
+                        stdout=StringIO(),
+                    )
+                    self.assertIn("6013", ruterstop.timetable)
+                finally:
+                    ruterstop.timetable = None
+            mock.assert_called_once_with(stop_id="6013", now=WEEKDAY)
+
+    def test_import_requires_output(self):
+        with self.assertRaises(SystemExit), patch("sys.stderr"):
+            ruterstop.main(["TEST", "--import-timetable", FEED], stdout=StringIO())
@@ -0,0 +1,135 @@
+import random
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+
+from webtest import TestApp
+
+import ruterstop
+from ruterstop import loadgen
+
+
+class FakeClock:
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+    def sleep(self, secs):
+        self.time += secs
+
+
+class ParseStopsTestCase(TestCase):
+    def test_weights(self):
+        stops = loadgen.parse_stops("6013=25,10-12", popularity="zipf:1")
+        self.assertEqual(
+            stops, [("6013", 25.0), ("10", 1 / 2), ("11", 1 / 3), ("12", 1 / 4)]
+        )
+
+        stops = loadgen.parse_stops("1,2", popularity="uniform")
+        self.assertEqual(stops, [("1", 1.0), ("2", 1.0)])
+
+        stops = loadgen.parse_stops("1,2-3=5", popularity="uniform")
+        self.assertEqual(stops, [("1", 1.0), ("2", 5.0), ("3", 5.0)])
+
+    def test_invalid(self):
+        for spec, popularity in [("", "zipf"), ("a", "zipf"), ("1", "pareto")]:
+            with self.assertRaises(ValueError):
+                loadgen.parse_stops(spec, popularity=popularity)
+
+
+class RandomPathTestCase(TestCase):
+    def test_paths_are_accepted_by_server(self):
+        rnd = random.Random(1)
+        app = TestApp(ruterstop.webapp)
+        with patch("ruterstop.get_departures", return_value=[]):
+            for _ in range(50):
+                path = loadgen.random_path(rnd, ["6013"], [1])
+                url = urlparse(path)
+                self.assertEqual(url.path, "/6013")
+                self.assertLessEqual(
+                    set(parse_qs(url.query)),
+                    {"direction", "min_eta", "grouped", "long_eta"},
+                )
+                app.get(path)
+
+
+class LoadGeneratorTestCase(TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(loadgen.percentile(values, 50), 50)
+        self.assertEqual(loadgen.percentile(values, 99), 99)
+        self.assertEqual(loadgen.percentile(values, 100), 100)
+        self.assertEqual(loadgen.percentile([], 50), 0.0)
+
+    def test_counts_requests_and_errors(self):
+        urls = []
+
+        def fetch(url):
+            urls.append(url)
+            if len(urls) % 10 == 0:
+                raise ConnectionError("refused")
+            return 500 if len(urls) % 5 == 0 else 200
+
+        stops = loadgen.parse_stops("1=1000,2=1")
+        gen = loadgen.LoadGenerator(
+            "http://localhost:4000/",
+            stops,
+            concurrency=3,
+            max_requests=100,
+            seed=0,
+            fetch=fetch,
+        )
+        report = gen.run()
+
+        self.assertEqual(report.requests, 100)
+        self.assertEqual(report.errors, {"HTTP 500": 10, "ConnectionError": 10})
+        self.assertTrue(all(u.startswith("http://localhost:4000/") for u in urls))
+        self.assertGreater(report.stops["1"], report.stops["2"])
+        self.assertIn("latency p99:", str(report))
+
+    def test_paces_requests_at_target_rate(self):
+        clock = FakeClock()
+        gen = loadgen.LoadGenerator(
+            "http://localhost",
+            [("1", 1)],
+            rate=10,
+            duration=2,
+            fetch=lambda url: 200,
+            clock=clock,
+            sleep=clock.sleep,
+        )
+        report = gen.run()
+        self.assertEqual(report.requests, 20)
+        self.assertAlmostEqual(clock.time, 1.9)
+
+    def test_cli(self):
+        report = loadgen.Report(3, loadgen.Counter(), 1.0, [0.1, 0.2, 0.3], {})
+        with patch("ruterstop.loadgen.LoadGenerator") as mock:
+            mock.return_value.run.return_value = report
+            out = StringIO()
+            ruterstop.main(
+                [
+                    "TEST",
+                    "--load-test",
+                    "http://x",
+                    "--load-stops",
+                    "1,2",
+                    "--load-requests",
+                    "3",
+                ],
+                stdout=out,
+            )
+        _, kwargs = mock.call_args
+        self.assertEqual(kwargs["max_requests"], 3)
+        self.assertIsNone(kwargs["duration"])
+        self.assertIn("throughput:  3.0 req/s", out.getvalue())
+
+    def test_cli_options_dont_shadow_others(self):
+        # An abbreviated --stop must still mean --stop-id
+        with patch("ruterstop.get_merged_departures", return_value=[]) as mock:
+            ruterstop.main(["TEST", "--stop", "6013"], stdout=StringIO())
+        _, kwargs = mock.call_args
+        self.assertEqual(kwargs["stop_ids"], ["6013"])
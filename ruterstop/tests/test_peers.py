@@ -0,0 +1,225 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from webtest import TestApp
+
+import ruterstop
+from ruterstop import server
+from ruterstop.fakeentur import JOURNEY_PLANNER_PATH, FakeEnTur, make_fake_server
+from ruterstop.peers import Cluster, HashRing, NearCache
+from ruterstop.utils import FakeClock
+
+NODES = ["http://a:4000", "http://b:4000", "http://c:4000"]
+
+
+class HashRingTestCase(TestCase):
+    def test_spreads_keys_over_nodes(self):
+        ring = HashRing(NODES)
+        owners = Counter(ring.owner(stop_id) for stop_id in range(3000))
+        self.assertEqual(set(owners), set(NODES))
+        self.assertTrue(all(n > 600 for n in owners.values()), owners)
+
+        # Same owners regardless of node order
+        other = HashRing(list(reversed(NODES)))
+        self.assertTrue(all(ring.owner(k) == other.owner(k) for k in range(100)))
+
+    def test_adding_a_node_moves_few_keys(self):
+        before = HashRing(NODES)
+        after = HashRing(NODES + ["http://d:4000"])
+        moved = [k for k in range(3000) if before.owner(k) != after.owner(k)]
+        self.assertLess(len(moved), 1200)
+        self.assertTrue(all(after.owner(k) == "http://d:4000" for k in moved))
+
+
+class NearCacheTestCase(TestCase):
+    def test_expiry_and_eviction(self):
+        with FakeClock() as clock:
+            cache = NearCache(size=2)
+            cache.put("a", 1, ttl=10)
+            cache.put("b", 2, ttl=20)
+            cache.put("c", 3, ttl=0)
+            self.assertEqual(cache.get("a"), 1)
+            self.assertIsNone(cache.get("c"))
+
+            # "b" is the least recently used
+            cache.put("d", 4, ttl=10)
+            self.assertIsNone(cache.get("b"))
+
+            clock.advance(seconds=10)
+            self.assertIsNone(cache.get("a"))
+            self.assertIsNone(cache.get("d"))
+
+
+class ClusterTestCase(TestCase):
+    def setUp(self):
+        self.fetch_local = Mock(return_value="local")
+        self.request = Mock(return_value=dict(data="remote", age=25))
+        self.clock = Mock(return_value=100.0)
+        self.cluster = Cluster(
+            nodes=NODES,
+            self_url="http://a:4000/",
+            fetch_local=self.fetch_local,
+            cache_sec=30,
+            near_cache=NearCache(clock=self.clock),
+            request=self.request,
+        )
+        ring = self.cluster.ring
+        self.own = next(k for k in range(100) if ring.owner(k) == "http://a:4000")
+        self.other = next(k for k in range(100) if ring.owner(k) == "http://b:4000")
+
+    def test_owned_stops_are_fetched_locally(self):
+        self.assertTrue(self.cluster.owns(self.own))
+        self.assertEqual(self.cluster.get_stop(self.own, time_range=60), "local")
+        self.fetch_local.assert_called_once_with(self.own, 60)
+        self.request.assert_not_called()
+
+    def test_other_stops_come_from_owner_and_near_cache(self):
+        for _ in range(2):
+            self.assertEqual(self.cluster.get_stop(self.other, time_range=60), "remote")
+        self.request.assert_called_once_with(
+            "http://b:4000/_cluster/stop/{}".format(self.other), dict(time_range=60)
+        )
+
+        # Cached for as long as the owner keeps it
+        self.clock.return_value += 5
+        self.cluster.get_stop(self.other, time_range=60)
+        self.assertEqual(self.request.call_count, 2)
+        self.fetch_local.assert_not_called()
+
+    def test_falls_back_to_upstream_when_owner_is_down(self):
+        self.request.side_effect = IOError("connection refused")
+        with self.assertLogs(logger="ruterstop", level="WARNING"):
+            self.assertEqual(self.cluster.get_stop(self.other, time_range=60), "local")
+
+    def test_node_must_be_in_cluster(self):
+        with self.assertRaises(ValueError):
+            Cluster(
+                nodes=NODES, self_url="http://d:4000", fetch_local=None, cache_sec=1
+            )
+
+
+class ClusterRouteTestCase(TestCase):
+    def setUp(self):
+        ruterstop.cluster = server.make_cluster(nodes=NODES, self_url=NODES[0])
+        self.app = TestApp(ruterstop.webapp)
+        self.clock = FakeClock().__enter__()
+        ruterstop.get_realtime_stop.cache_clear()
+
+    def tearDown(self):
+        ruterstop.cluster = None
+        self.clock.__exit__()
+        ruterstop.get_realtime_stop.cache_clear()
+
+    @patch("ruterstop.request_realtime_stop")
+    def test_not_found_outside_a_cluster(self, request_mock):
+        ruterstop.cluster = None
+        res = self.app.get("/_cluster/stop/6013", expect_errors=True)
+        self.assertEqual(res.status_code, 404)
+        request_mock.assert_not_called()
+
+    @patch("ruterstop.request_realtime_stop", return_value=dict(data="raw"))
+    def test_serves_only_known_time_ranges(self, request_mock):
+        for query in ["", "?time_range=72100", "?time_range=3540"]:
+            res = self.app.get("/_cluster/stop/6013" + query)
+            self.assertEqual(res.json, dict(data=dict(data="raw"), age=0))
+        self.assertEqual(request_mock.call_count, 2)
+
+        for query in ["?time_range=3541", "?time_range=-1", "?time_range=abc"]:
+            res = self.app.get("/_cluster/stop/6013" + query, expect_errors=True)
+            self.assertEqual(res.status_code, 400)
+            self.assertEqual(res.body, "Ugyldig tidsrom".encode())
+        self.assertEqual(request_mock.call_count, 2)
+
+    @patch("ruterstop.request_realtime_stop")
+    def test_concurrent_requests_share_one_upstream_call(self, request_mock):
+        def slow_request(**_):
+            time.sleep(0.1)
+            return dict(data="raw")
+
+        request_mock.side_effect = slow_request
+        with ThreadPoolExecutor(max_workers=6) as pool:
+            responses = list(
+                pool.map(
+                    lambda _: TestApp(ruterstop.webapp).get("/_cluster/stop/6013"),
+                    range(6),
+                )
+            )
+        self.assertTrue(all(r.json["data"] == dict(data="raw") for r in responses))
+        self.assertEqual(request_mock.call_count, 1)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class ClusterProcessesTestCase(TestCase):
+    """Three server processes in a cluster against a fake EnTur API"""
+
+    def setUp(self):
+        self.fake = FakeEnTur()
+        self.upstream = make_fake_server(self.fake)
+        threading.Thread(target=self.upstream.serve_forever, daemon=True).start()
+
+        env = dict(os.environ)
+        env["RUTERSTOP_ENTUR_GRAPHQL_ENDPOINT"] = "http://127.0.0.1:{}{}".format(
+            self.upstream.server_port, JOURNEY_PLANNER_PATH
+        )
+        ports = [free_port() for _ in range(3)]
+        self.urls = ["http://127.0.0.1:{}".format(p) for p in ports]
+        self.procs = [
+            subprocess.Popen(
+                [sys.executable, "-m", "ruterstop", "--server", "--host", "127.0.0.1"]
+                + ["--port", str(port), "--cluster-nodes", ",".join(self.urls)]
+                + ["--cluster-self", url],
+                cwd=os.path.dirname(os.path.dirname(ruterstop.__file__)),
+                env=env,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+            )
+            for port, url in zip(ports, self.urls)
+        ]
+        for url in self.urls:
+            self.wait_for(url)
+
+    def tearDown(self):
+        for proc in self.procs:
+            proc.terminate()
+            proc.wait()
+        self.upstream.shutdown()
+        self.upstream.server_close()
+
+    def wait_for(self, url):
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                urllib.request.urlopen(url + "/", timeout=1)
+            except urllib.error.HTTPError:
+                return  # Serving 404 for /
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.05)
+
+    def test_upstream_calls_per_distinct_stop(self):
+        stops = range(6000, 6012)
+        for url in self.urls:
+            for stop_id in stops:
+                with urllib.request.urlopen("{}/{}".format(url, stop_id)) as res:
+                    self.assertEqual(res.status, 200)
+                    self.assertTrue(res.read())
+
+        stats = self.fake.stats()
+        self.assertEqual(stats["calls"]["journey_planner"], len(stops))
+        self.assertEqual(set(stats["stops"].values()), {1})
@@ -0,0 +1,202 @@
+import os
+import tempfile
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import patch
+
+from webtest import TestApp
+
+import ruterstop
+from ruterstop import server
+from ruterstop.gtfs import compile_gtfs
+from ruterstop.peers import Cluster
+from ruterstop.profiles import Profile, load_profiles
+from ruterstop.utils import FakeClock
+
+CONFIG = """
+[kitchen]
+stops = [6013, 6014]
+direction = "outbound"
+min_eta = 2
+long_eta = 30
+grouped = true
+
+[hallway]
+stops = "6013"
+"""
+
+FEED = os.path.join(os.path.dirname(__file__), "test_gtfs_feed")
+NODES = ["http://a:4000", "http://b:4000"]
+
+
+class CompileTestCase(TestCase):
+    def test_compiles_options_once(self):
+        p = Profile.compile(
+            "kitchen", dict(stops=[6013], direction=["inbound", "outbound"])
+        )
+        self.assertEqual(p.stop_ids, [6013])
+        self.assertEqual(p.options, dict(directions={"inbound", "outbound"}))
+
+    def test_invalid_profiles(self):
+        for name, table in [
+            ("kitchen", dict()),
+            ("kitchen", dict(stops=["abc"])),
+            ("kitchen", dict(stops=[1], direction="up")),
+            ("kitchen", dict(stops=[1], min_eta="2")),
+            ("kitchen", dict(stops=[1], colour="red")),
+            ("kitchen/1", dict(stops=[1])),
+        ]:
+            with self.assertRaises(ValueError):
+                Profile.compile(name, table)
+
+    def test_load_profiles(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "profiles.toml")
+            with open(path, "w") as fp:
+                fp.write(CONFIG)
+            profiles = load_profiles(path)
+
+            with open(path, "w") as fp:
+                fp.write("[kitchen")
+            with self.assertRaises(ValueError):
+                load_profiles(path)
+
+        self.assertEqual(sorted(profiles), ["hallway", "kitchen"])
+        self.assertEqual(profiles["hallway"].stop_ids, [6013])
+        self.assertEqual(
+            profiles["kitchen"].options,
+            dict(directions={"outbound"}, min_eta=2, long_eta=30, grouped=True),
+        )
+
+
+class RenderCacheTestCase(TestCase):
+    def setUp(self):
+        self.now = datetime(2021, 5, 10, 8, 0, 0)
+        self.deps = [
+            ruterstop.Departure(
+                "31", "Fornebu", self.now + timedelta(seconds=90), "outbound"
+            ),
+        ]
+        self.profile = Profile.compile("kitchen", dict(stops=[6013], min_eta=0))
+        ruterstop.get_realtime_stop.cache_clear()
+        self.clock = FakeClock(self.now).__enter__()
+
+    def tearDown(self):
+        self.clock.__exit__()
+        ruterstop.get_realtime_stop.cache_clear()
+
+    @patch("ruterstop.format_departure_list", return_value="31 Fornebu   1 min\n")
+    @patch("ruterstop.get_merged_departures")
+    def test_reuses_board_until_an_eta_changes(self, get_mock, format_mock):
+        get_mock.side_effect = lambda **_: iter(self.deps)
+        ruterstop.get_realtime_stop.cache_prime({}, 0, stop_id=6013)
+
+        for secs in [0, 10, 19]:
+            self.clock.advance(seconds=secs)
+            self.assertEqual(self.profile.render(), "31 Fornebu   1 min\n")
+        self.assertEqual(format_mock.call_count, 1)
+        format_mock.assert_called_once_with(self.deps, min_eta=0, now=self.now)
+        get_mock.assert_called_once_with(stop_ids=[6013], now=self.now)
+
+        # The ETA rolls over to the next minute after 30 seconds
+        self.clock.advance(seconds=1)
+        self.profile.render()
+        self.assertEqual(format_mock.call_count, 2)
+
+    @patch("ruterstop.format_departure_list", return_value="")
+    @patch("ruterstop.get_merged_departures", return_value=[])
+    def test_expires_with_upstream_data(self, get_mock, _):
+        ruterstop.get_realtime_stop.cache_prime({}, 25, stop_id=6013)
+        self.profile.render()
+        self.clock.advance(seconds=4)
+        self.profile.render()
+        self.assertEqual(get_mock.call_count, 1)
+        self.clock.advance(seconds=1)
+        self.profile.render()
+        self.assertEqual(get_mock.call_count, 2)
+
+        # Nothing is reused when the upstream data isn't in the cache
+        ruterstop.get_realtime_stop.cache_clear()
+        self.profile.render()
+        self.profile.render()
+        self.assertEqual(get_mock.call_count, 4)
+
+    def assert_rendered_again_after(self, get_mock, secs, profile=None):
+        profile = profile or self.profile
+        profile.render()
+        self.clock.advance(seconds=secs - 1)
+        profile.render()
+        self.assertEqual(get_mock.call_count, 1)
+        self.clock.advance(seconds=1)
+        profile.render()
+        self.assertEqual(get_mock.call_count, 2)
+
+    @patch("ruterstop.format_departure_list", return_value="")
+    @patch("ruterstop.get_merged_departures", return_value=[])
+    def test_expires_with_timetable_realtime_data(self, get_mock, _):
+        ruterstop.timetable = compile_gtfs(FEED)
+        self.addCleanup(setattr, ruterstop, "timetable", None)
+        ruterstop.get_realtime_stop.cache_prime(
+            {}, 25, stop_id=6013, time_range=ruterstop.TIMETABLE_REALTIME_MIN * 60
+        )
+        self.assert_rendered_again_after(get_mock, 5)
+
+    @patch("ruterstop.format_departure_list", return_value="")
+    @patch("ruterstop.get_merged_departures", return_value=[])
+    def test_expires_with_cluster_near_cache(self, get_mock, _):
+        cluster = Cluster(
+            nodes=NODES, self_url=NODES[0], fetch_local=None, cache_sec=30
+        )
+        stop_id = next(s for s in range(6000, 6100) if not cluster.owns(s))
+        ruterstop.cluster = cluster
+        self.addCleanup(setattr, ruterstop, "cluster", None)
+
+        key = (stop_id, ruterstop.REALTIME_TIME_RANGE_SEC)
+        cluster.near_cache.put(key, {}, ttl=7)
+        profile = Profile.compile("hallway", dict(stops=[stop_id]))
+        self.assert_rendered_again_after(get_mock, 7, profile)
+
+
+class ProfileRouteTestCase(TestCase):
+    def setUp(self):
+        self.app = TestApp(ruterstop.webapp)
+        server.profiles = dict(
+            kitchen=Profile.compile(
+                "kitchen", dict(stops=[6013, 6014], direction="outbound", min_eta=2)
+            )
+        )
+
+    def tearDown(self):
+        server.profiles = {}
+
+    @patch("ruterstop.get_merged_departures", return_value=[])
+    def test_serves_profile_boards(self, get_mock):
+        now = datetime(2021, 5, 10, 8, 0, 0)
+        with patch("ruterstop.format_departure_list", return_value="board") as fmt:
+            with FakeClock(now):
+                res = self.app.get("/p/kitchen")
+        self.assertEqual(res.content_type, "text/plain")
+        self.assertEqual(res.body, b"board")
+        get_mock.assert_called_once_with(stop_ids=[6013, 6014], now=now)
+        fmt.assert_called_once_with([], directions={"outbound"}, min_eta=2, now=now)
+
+    def test_unknown_profile(self):
+        res = self.app.get("/p/office", expect_errors=True)
+        self.assertEqual(res.status_code, 404)
+        self.assertEqual(res.body, "Ukjent profil".encode())
+
+    @patch("bottle.run")
+    def test_cli_loads_profiles(self, _):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "profiles.toml")
+            with open(path, "w") as fp:
+                fp.write(CONFIG)
+            ruterstop.main(["TEST", "--server", "--profiles", path], stdout=StringIO())
+            self.assertEqual(sorted(server.profiles), ["hallway", "kitchen"])
+
+            with self.assertRaises(SystemExit), patch("sys.stderr"):
+                ruterstop.main(
+                    ["TEST", "--server", "--profiles", path + ".missing"],
+                    stdout=StringIO(),
+                )
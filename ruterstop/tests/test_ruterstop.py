@@ -1,21 +1,20 @@
 import inspect
 import json
 import os
+import threading
 from datetime import datetime, timedelta
 from io import StringIO
 from unittest import TestCase
 from unittest.mock import Mock, MagicMock, patch
 
-from freezegun import freeze_time
-
 import ruterstop
+from ruterstop.utils import FakeClock
 
 
 class DepartureClassTestCase(TestCase):
     def test_str_representation(self):
-        with patch("ruterstop.utils.datetime") as mock_date:
-            ref = datetime.min
-            mock_date.now.return_value = ref
+        ref = datetime.min
+        with FakeClock(ref):
             in_7_mins = ref + timedelta(minutes=7)
             in_77_mins = ref + timedelta(minutes=77)
 
@@ -90,6 +89,24 @@ class RuterstopTestCase(TestCase):
             self.assertIsNotNone(d.direction)
         self.assertNotEqual(i, 0, "no items were returned")
 
+    def test_merges_stops_in_eta_order(self):
+        from ruterstop.fakeentur import synthetic_departures
+
+        raw = {s: synthetic_departures(s, 10) for s in (1, 2, 3)}
+        # All three fetches must be in flight at the same time to pass
+        barrier = threading.Barrier(3, timeout=5)
+
+        def fetch(*, stop_id):
+            barrier.wait()
+            return raw[stop_id]
+
+        with patch("ruterstop.get_realtime_stop", side_effect=fetch) as mock:
+            deps = list(ruterstop.get_merged_departures(stop_ids=[1, 2, 3, 2]))
+            self.assertEqual(mock.call_count, 3)
+
+        self.assertEqual(len(deps), 30)
+        self.assertEqual(deps, sorted(deps, key=lambda d: d.eta))
+
     @patch("ruterstop.get_realtime_stop", return_value=None)
     def test_does_not_hide_realtime_departures_after_eta(self, _):
         now = datetime.now()
@@ -151,7 +168,7 @@ class RuterstopTestCase(TestCase):
     @patch("ruterstop.get_realtime_stop", return_value=None)
     def test_shows_timestamp_for_long_etas(self, _):
         seed = datetime(2020, 1, 1, 10, 0, 0)
-        with freeze_time(seed):
+        with FakeClock(seed):
 
             def futr(minutes):
                 return seed + timedelta(minutes=minutes)
@@ -174,3 +191,32 @@ class RuterstopTestCase(TestCase):
                 self.assertEqual(lines[0], "01 a            11:00")
                 self.assertEqual(lines[1], "02 b            12:00")
                 self.assertEqual(lines[2], "03 c            12:30")
+
+    @patch("ruterstop.get_realtime_stop", return_value=None)
+    def test_shows_only_planned_departures_in_unknown_direction(self, _):
+        seed = datetime(2020, 1, 1, 10, 0, 0)
+        with FakeClock(seed):
+            eta = seed + timedelta(minutes=5, seconds=1)
+            d = ruterstop.Departure
+            deps = [
+                d("01", "a", eta, "inbound", realtime=True, id="RUT:1"),
+                d("02", "b", eta, "unknown", realtime=True, id="RUT:2"),
+                d("03", "c", eta, "unknown", realtime=False, id="RUT:3"),
+                # Planned in a timetable, without realtime data or ID
+                d("04", "d", eta, "unknown"),
+            ]
+
+            with patch("ruterstop.parse_departures", return_value=deps):
+                with StringIO() as output:
+                    ruterstop.main(["", "--stop-id=2121"], stdout=output)
+                    lines = output.getvalue().split("\n")
+                self.assertEqual(
+                    lines, ["01 a            5 min", "04 d            5 min", "", ""]
+                )
+
+                # Not when filtering on a direction
+                with StringIO() as output:
+                    args = ["", "--stop-id=2121", "--direction=inbound"]
+                    ruterstop.main(args, stdout=output)
+                    lines = output.getvalue().split("\n")
+                self.assertEqual(lines, ["01 a            5 min", "", ""])
@@ -0,0 +1,144 @@
+from datetime import datetime, timedelta
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from webtest import TestApp
+
+import ruterstop
+from ruterstop import server
+from ruterstop.fakeentur import synthetic_departures
+from ruterstop.updates import DeltaLog, departure_key, format_delta, timestamp
+from ruterstop.utils import FakeClock
+
+NOW = datetime(2021, 5, 10, 8, 0, 0)
+
+
+def dep(journey, mins, direction="outbound", realtime=True):
+    return ruterstop.Departure(
+        "31",
+        "Snaroeya",
+        NOW + timedelta(minutes=mins),
+        direction,
+        realtime,
+        "RUT:ServiceJourney:" + journey,
+    )
+
+
+class DepartureKeyTestCase(TestCase):
+    def test_keys(self):
+        self.assertEqual(departure_key(dep("a", 1)), departure_key(dep("a", 3)))
+        self.assertNotEqual(departure_key(dep("a", 1)), departure_key(dep("b", 1)))
+        self.assertRegex(departure_key(dep("a", 1)), r"^[0-9a-f]{8}$")
+
+        # Without a journey ID the ETA is part of the key
+        d = dep("a", 1)._replace(id=None)
+        self.assertNotEqual(
+            departure_key(d), departure_key(d._replace(eta=d.eta + timedelta(1)))
+        )
+
+    def test_journey_ids_are_parsed(self):
+        deps = list(ruterstop.parse_departures(synthetic_departures(6013, 5)))
+        self.assertEqual(len({departure_key(d) for d in deps}), 5)
+        self.assertTrue(all(d.id.startswith("RUT:ServiceJourney:") for d in deps))
+
+
+class DeltaLogTestCase(TestCase):
+    def setUp(self):
+        self.clock = Mock(return_value=1000.0)
+        self.log = DeltaLog(history=3, clock=self.clock)
+
+    def test_new_versions_only_on_change(self):
+        v1 = self.log.update([dep("a", 1)])
+        self.assertEqual(v1, 1000000)
+        self.assertEqual(self.log.update([dep("a", 1)]), v1)
+
+        # Versions increase even if the clock doesn't
+        v2 = self.log.update([dep("a", 2)])
+        self.assertEqual(v2, v1 + 1)
+
+    def test_changes_since_version(self):
+        v1 = self.log.update([dep("a", 1), dep("b", 5), dep("c", 9)])
+        self.clock.return_value += 30
+        v2 = self.log.update([dep("b", 6), dep("c", 9), dep("d", 12)])
+
+        version, full, changes = self.log.changes(v1)
+        self.assertEqual((version, full), (v2, False))
+        self.assertEqual(
+            [(op, d.id[-1]) for op, _, d in changes],
+            [("-", "a"), ("~", "b"), ("+", "d")],
+        )
+        self.assertEqual(changes[1][2].eta, NOW + timedelta(minutes=6))
+
+        self.assertEqual(self.log.changes(v2), (v2, False, []))
+
+    def test_full_snapshot_for_unknown_versions(self):
+        v1 = self.log.update([dep("a", 1)])
+        for i in range(3):
+            self.clock.return_value += 30
+            self.log.update([dep("a", 2 + i), dep("b", 5)])
+
+        for since in [None, 12345, v1]:
+            version, full, changes = self.log.changes(since)
+            self.assertTrue(full)
+            self.assertEqual([op for op, _, _ in changes], ["+", "+"])
+
+    def test_direction_filter(self):
+        v1 = self.log.update([dep("a", 1, "inbound"), dep("b", 5)])
+        self.log.update([dep("b", 6), dep("c", 7, "inbound")])
+
+        _, _, changes = self.log.changes(v1, directions="outbound")
+        self.assertEqual([(op, d.id[-1]) for op, _, d in changes], [("~", "b")])
+
+
+class FormatDeltaTestCase(TestCase):
+    def test_format(self):
+        d = dep("a", 5)
+        ts = timestamp(d.eta)
+        key = departure_key(d)
+        changes = [("+", key, d), ("~", key, d._replace(realtime=False)), ("-", key, d)]
+
+        self.assertEqual(
+            format_delta(42, False, changes, now=NOW),
+            "42 {} delta\n"
+            "+ {key} {ts} 1 outbound 31 Snaroeya\n"
+            "~ {key} {ts} 0\n"
+            "- {key}\n".format(timestamp(NOW), key=key, ts=ts),
+        )
+        self.assertEqual(ts - timestamp(NOW), 300)
+
+
+class DeltaRouteTestCase(TestCase):
+    def setUp(self):
+        self.app = TestApp(ruterstop.webapp)
+        self.clock = FakeClock(NOW).__enter__()
+
+    def tearDown(self):
+        self.clock.__exit__()
+        server.delta_logs.clear()
+
+    @patch("ruterstop.get_departures")
+    def test_polling_client(self, get_mock):
+        get_mock.return_value = [dep("a", 1), dep("b", 5)]
+        res = self.app.get("/6013/delta")
+        self.assertEqual(res.content_type, "text/plain")
+        lines = res.text.splitlines()
+        version, generated, kind = lines[0].split()
+        self.assertEqual(kind, "full")
+        self.assertEqual(int(generated), timestamp(NOW))
+        self.assertEqual(int(version), timestamp(NOW) * 1000)
+        self.assertEqual(len(lines), 3)
+
+        # Nothing new
+        res = self.app.get("/6013/delta?since=" + version)
+        self.assertEqual(res.text.split()[0], version)
+        self.assertEqual(len(res.text.splitlines()), 1)
+
+        get_mock.return_value = [dep("b", 4)]
+        res = self.app.get("/6013/delta?since=" + version)
+        lines = res.text.splitlines()
+        self.assertEqual(lines[0].split()[2], "delta")
+        self.assertEqual([line[0] for line in lines[1:]], ["-", "~"])
+        get_mock.assert_called_with(stop_id=6013, now=NOW)
+
+        res = self.app.get("/6013/delta?since=bogus")
+        self.assertEqual(res.text.splitlines()[0].split()[2], "full")
@@ -1,8 +1,11 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from unittest import TestCase
-from unittest.mock import Mock, MagicMock, patch
+from unittest.mock import Mock
 
 import ruterstop
+from ruterstop.utils import FakeClock, seconds_until_change
 
 
 class HumanDeltaTestCase(TestCase):
@@ -24,10 +27,9 @@ class HumanDeltaTestCase(TestCase):
             self.assertEqual(res, expected, "test case #%d" % (i + 1))
 
     def test_default_kwarg_value(self):
-        with patch("ruterstop.utils.datetime") as mock_date:
-            mock_date.now.return_value = datetime.min
-            ruterstop.human_delta(until=datetime.min + timedelta(seconds=120))
-            self.assertEqual(mock_date.now.call_count, 1)
+        with FakeClock(datetime.min):
+            res = ruterstop.human_delta(until=datetime.min + timedelta(seconds=120))
+        self.assertEqual(res, " 2 min")
 
 
 class NorwegianAsciiTestCase(TestCase):
@@ -47,10 +49,10 @@ class NorwegianAsciiTestCase(TestCase):
 
 class TimedCacheTestCase(TestCase):
     def test_timed_cache(self):
-        now = MagicMock()
+        clock = FakeClock()
         spy = Mock(return_value=1)  # don't need return value
 
-        @ruterstop.timed_cache(expires_sec=60, now=now)
+        @ruterstop.timed_cache(expires_sec=60, clock=clock)
         def func(a, b=None):
             spy()  # for counting calls
             return [a, b]  # return list to compare references
@@ -67,11 +69,80 @@ class TimedCacheTestCase(TestCase):
             self.assertEqual(spy.call_count, 2)
 
         # Test cache function
-        now.return_value = datetime.min
         test_set()
         spy.reset_mock()
 
         # Test expired key invokes function again
-        now.return_value = datetime.min + timedelta(seconds=61)
+        clock.advance(seconds=61)
         test_set()
         spy.reset_mock()
+
+    def test_timed_cache_calls_once_for_concurrent_misses(self):
+        started = threading.Event()
+        release = threading.Event()
+        spy = Mock(return_value="fresh")
+
+        @ruterstop.timed_cache(expires_sec=60, clock=FakeClock())
+        def func(stop_id):
+            started.set()
+            release.wait(5)
+            return spy(stop_id)
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            results = [pool.submit(func, 1) for _ in range(8)]
+            other = pool.submit(func, 2)
+            started.wait(5)
+            release.set()
+        self.assertEqual([r.result() for r in results], ["fresh"] * 8)
+        self.assertEqual(other.result(), "fresh")
+        self.assertEqual(spy.call_count, 2)
+
+    def test_timed_cache_ignores_wall_clock_changes(self):
+        spy = Mock(return_value="fresh")
+
+        @ruterstop.timed_cache(expires_sec=60)
+        def func():
+            return spy()
+
+        with FakeClock(datetime(2021, 3, 28, 1, 59)) as clock:
+            func()
+            clock.set(datetime(2021, 3, 28, 3, 0))  # DST starts
+            func()
+            self.assertEqual(spy.call_count, 1)
+
+            clock.set(datetime(2021, 3, 28, 1, 0))  # NTP turns the clock back
+            clock.advance(seconds=61)
+            func()
+            self.assertEqual(spy.call_count, 2)
+
+    def test_timed_cache_peek_and_prime(self):
+        clock = FakeClock()
+        spy = Mock(return_value="fresh")
+
+        @ruterstop.timed_cache(expires_sec=60, clock=clock)
+        def func(*, stop_id):
+            return spy()
+
+        self.assertIsNone(func.cache_peek(stop_id=1))
+        func.cache_prime("restored", 50, stop_id=1)
+        self.assertEqual(func.cache_peek(stop_id=1), ("restored", 50))
+        self.assertEqual(func(stop_id=1), "restored")
+        self.assertEqual(spy.call_count, 0)
+
+        # Primed entries expire by their own age
+        clock.advance(seconds=11)
+        self.assertEqual(func(stop_id=1), "fresh")
+
+
+class SecondsUntilChangeTestCase(TestCase):
+    def test_next_minute_rollover(self):
+        now = datetime(2021, 1, 1, 12, 0, 0)
+        d = ruterstop.Departure
+        deps = [
+            d("1", "a", now - timedelta(seconds=30), "inbound"),
+            d("2", "b", now + timedelta(minutes=3, seconds=40), "inbound"),
+            d("3", "c", now + timedelta(minutes=1, seconds=25), "inbound"),
+        ]
+        self.assertEqual(seconds_until_change(deps, now), 25)
+        self.assertEqual(seconds_until_change(deps[:1], now), None)
+        self.assertEqual(seconds_until_change([d("1", "", now, "")], now), 60)
@@ -0,0 +1,200 @@
+import os
+import tempfile
+import threading
+from datetime import datetime, time, timedelta
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+from webtest import TestApp
+
+import ruterstop
+from ruterstop import server
+from ruterstop.warmup import (
+    Popularity,
+    Warmer,
+    load_state,
+    next_occurrence,
+    parse_times,
+    save_state,
+)
+from ruterstop.utils import FakeClock
+
+MORNING = datetime(2021, 5, 10, 7, 30)
+
+
+def payload(stop_id):
+    return dict(data=dict(stopPlace=dict(id=str(stop_id), estimatedCalls=[])))
+
+
+class PopularityTestCase(TestCase):
+    def test_hot_stops_per_hour(self):
+        pop = Popularity()
+        for stop_id in [1, 2, 2, 3, 3, 3]:
+            pop.record(stop_id, when=MORNING)
+        pop.record(4, when=MORNING.replace(hour=16))
+
+        self.assertEqual(pop.hot(7), [3, 2, 1])
+        self.assertEqual(pop.hot(7, limit=1), [3])
+        self.assertEqual(pop.hot(16), [4])
+        # Hours without requests fall back to the totals
+        self.assertEqual(pop.hot(3)[0], 3)
+
+    def test_state_roundtrip(self):
+        pop = Popularity()
+        pop.record(6013, when=MORNING)
+        fetched = datetime(2021, 5, 10, 7, 29, 45, 500000)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "state.json")
+            self.assertEqual(load_state(path)[1], [])
+
+            save_state(path, popularity=pop, payloads=[(6013, payload(6013), fetched)])
+            loaded, payloads = load_state(path)
+            self.assertEqual(loaded.hot(7), [6013])
+            self.assertEqual(payloads, [(6013, payload(6013), fetched)])
+
+            with open(path, "w") as fp:
+                fp.write("{")
+            with self.assertLogs(logger="ruterstop", level="WARNING"):
+                self.assertEqual(load_state(path)[1], [])
+
+
+class ScheduleTestCase(TestCase):
+    def test_parse_times(self):
+        self.assertEqual(parse_times("16:00, 07:15"), [time(7, 15), time(16, 0)])
+        with self.assertRaises(ValueError):
+            parse_times("7")
+
+    def test_next_occurrence(self):
+        times = [time(7, 15), time(16, 0)]
+        self.assertEqual(
+            next_occurrence(times, MORNING), MORNING.replace(hour=16, minute=0)
+        )
+        self.assertEqual(
+            next_occurrence(times, MORNING.replace(hour=17)),
+            datetime(2021, 5, 11, 7, 15),
+        )
+
+
+class WarmerTestCase(TestCase):
+    def test_paced_fetches_survive_errors(self):
+        fetch = Mock(side_effect=[None, IOError("down"), None])
+        sleep = Mock()
+        warmer = Warmer(fetch, popularity=Popularity(), interval=0.5, sleep=sleep)
+
+        with self.assertLogs(logger="ruterstop", level="WARNING"):
+            self.assertEqual(warmer.warm([1, 2, 3]), 2)
+        self.assertEqual(sleep.call_count, 2)
+        sleep.assert_called_with(0.5)
+
+    def test_warm_hot_skips_restored_stops(self):
+        pop = Popularity()
+        for stop_id in [1, 2, 2]:
+            pop.record(stop_id, when=MORNING)
+        fetch = Mock()
+        warmer = Warmer(fetch, popularity=pop, sleep=Mock(), now=lambda: MORNING)
+
+        warmer.warm_hot(skip={2})
+        fetch.assert_called_once_with(1)
+
+    def test_schedule_spreads_fetches_before_peak(self):
+        pop = Popularity()
+        for stop_id in [1, 2, 3]:
+            pop.record(stop_id, when=MORNING.replace(hour=16))
+
+        clock = dict(now=MORNING)
+        sleeps = []
+
+        def sleep(secs):
+            sleeps.append(secs)
+            if len(sleeps) > 3:
+                raise KeyboardInterrupt
+            clock["now"] += timedelta(seconds=secs)
+
+        fetch = Mock()
+        warmer = Warmer(fetch, popularity=pop, sleep=sleep, now=lambda: clock["now"])
+        with self.assertRaises(KeyboardInterrupt):
+            warmer.run_schedule([time(16, 0)], lead_sec=30)
+
+        # Waits until 30 seconds before 16:00, then fetches 10 seconds apart
+        self.assertEqual(sleeps[:3], [8.5 * 3600 - 30, 10, 10])
+        self.assertEqual(fetch.call_count, 3)
+
+
+class ServerWarmupTestCase(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "state.json")
+        ruterstop.get_realtime_stop.cache_clear()
+
+    def tearDown(self):
+        server.popularity = None
+        ruterstop.get_realtime_stop.cache_clear()
+        self.tmp.cleanup()
+
+    @patch("ruterstop.format_departure_list", return_value="")
+    @patch("ruterstop.get_merged_departures", return_value=[])
+    @patch("ruterstop.get_departures", return_value=[])
+    def test_tracks_requested_stops(self, *_):
+        app = TestApp(ruterstop.webapp)
+        with FakeClock(MORNING):
+            app.get("/1")
+
+            server.popularity = Popularity()
+            app.get("/1")
+            app.get("/2,1")
+        self.assertEqual(server.popularity.hot(MORNING.hour), [1, 2])
+
+    def test_restores_fresh_payloads_only(self):
+        pop = Popularity()
+        pop.record(1, when=MORNING)
+        payloads = [
+            (1, payload(1), MORNING - timedelta(seconds=5)),
+            (2, payload(2), MORNING - timedelta(minutes=5)),
+            (3, payload(3), MORNING + timedelta(minutes=5)),
+        ]
+        save_state(self.path, popularity=pop, payloads=payloads)
+
+        with FakeClock(MORNING):
+            self.assertEqual(server.restore_state(self.path), {1})
+            self.assertEqual(
+                ruterstop.get_realtime_stop.cache_peek(stop_id=1), (payload(1), 5)
+            )
+        self.assertEqual(server.popularity.hot(MORNING.hour), [1])
+        self.assertIsNone(ruterstop.get_realtime_stop.cache_peek(stop_id=2))
+        self.assertIsNone(ruterstop.get_realtime_stop.cache_peek(stop_id=3))
+
+    def test_saves_fetch_times_of_hot_payloads(self):
+        server.popularity = Popularity()
+        server.popularity.record(1, when=MORNING)
+        with FakeClock(MORNING) as clock:
+            ruterstop.get_realtime_stop.cache_prime(payload(1), 0, stop_id=1)
+            clock.advance(seconds=20)
+            server.save_state(self.path)
+
+        _, payloads = load_state(self.path)
+        self.assertEqual(payloads, [(1, payload(1), MORNING)])
+
+    def test_run_warms_and_saves_state_on_shutdown(self):
+        pop = Popularity()
+        pop.record(6013, when=MORNING)
+        save_state(self.path, popularity=pop, payloads=[])
+
+        warmed = threading.Event()
+
+        def request(*, stop_id, **_):
+            warmed.set()
+            return payload(stop_id)
+
+        def serve(*args, **kwargs):
+            self.assertTrue(warmed.wait(5))
+            server.popularity.record(6014)
+
+        with patch("ruterstop.request_realtime_stop", side_effect=request), patch(
+            "bottle.run", side_effect=serve
+        ), FakeClock(MORNING):
+            server.run(host="localhost", port=0, state_file=self.path)
+
+        pop, payloads = load_state(self.path)
+        self.assertEqual(pop.hot(MORNING.hour), [6013, 6014])
+        self.assertEqual([p[:2] for p in payloads], [(6013, payload(6013))])
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import TestCase
+from unittest.mock import Mock, patch
+
+import ruterstop
+from ruterstop.utils import FakeClock
+from ruterstop.watch import TerminalBoard, watch
+
+
+class Sleeper:
+    """Sleeps by moving a FakeClock, and stops watch() after `frames` frames"""
+
+    def __init__(self, clock, frames):
+        self.clock = clock
+        self.frames = frames
+        self.sleeps = []
+
+    def __call__(self, secs):
+        self.sleeps.append(secs)
+        if len(self.sleeps) >= self.frames:
+            raise KeyboardInterrupt
+        self.clock.advance(seconds=secs)
+
+
+class TerminalBoardTestCase(TestCase):
+    def test_redraws_changed_lines_only(self):
+        out = StringIO()
+        board = TerminalBoard(out)
+
+        board.draw("a\nb\nc\n")
+        self.assertIn("\x1b[2J", out.getvalue())
+        self.assertIn("\x1b[3;1Hc\x1b[K", out.getvalue())
+
+        out.seek(0)
+        out.truncate()
+        self.assertEqual(board.draw("a\nB\nc\n"), 1)
+        self.assertEqual(out.getvalue(), "\x1b[2;1HB\x1b[K")
+
+        out.seek(0)
+        out.truncate()
+        self.assertEqual(board.draw("a\n"), 2)
+        self.assertEqual(out.getvalue(), "\x1b[2;1H\x1b[K\x1b[3;1H\x1b[K")
+
+        self.assertEqual(board.draw("a\n"), 0)
+
+
+class WatchTestCase(TestCase):
+    def test_refetches_on_interval_and_rerenders_in_between(self):
+        now = datetime(2021, 1, 1, 12, 0, 0)
+        deps = [ruterstop.Departure("1", "a", now + timedelta(seconds=90), "inbound")]
+        fetch = Mock(return_value=deps)
+        render = Mock(return_value="1 a\n")
+
+        with FakeClock(now) as clock:
+            sleep = Sleeper(clock, frames=4)
+            watch(fetch, render, stream=StringIO(), refresh_sec=60, sleep=sleep)
+
+        # Wakes just after the ETA rollover at 30s, then refreshes at 60s
+        self.assertAlmostEqual(sleep.sleeps[0], 30.05)
+        self.assertAlmostEqual(sleep.sleeps[1], 29.95)
+        self.assertEqual(fetch.call_count, 2)
+        self.assertEqual(render.call_count, 4)
+
+    def test_keeps_old_data_when_fetch_fails(self):
+        now = datetime(2021, 1, 1, 12, 0, 0)
+        deps = [ruterstop.Departure("1", "a", now, "inbound")]
+        fetch = Mock(side_effect=[deps, IOError("down")])
+        render = Mock(return_value="")
+
+        with self.assertLogs(logger="ruterstop", level="WARNING"):
+            with FakeClock(now) as clock:
+                sleep = Sleeper(clock, frames=3)
+                watch(fetch, render, stream=StringIO(), refresh_sec=1, sleep=sleep)
+        self.assertEqual(render.call_args_list[-1][0][0], deps)
+
+    @patch("ruterstop.get_departures", return_value=[])
+    def test_cli_watch_mode(self, get_mock):
+        with patch("ruterstop.watch.watch") as watch_mock:
+            ruterstop.main(["TEST", "--stop-id", "1", "--watch"], stdout=StringIO())
+        try:
+            self.assertIsNotNone(ruterstop.http_session)
+        finally:
+            ruterstop.http_session = None
+
+        fetch, render = watch_mock.call_args[0]
+        self.assertEqual(watch_mock.call_args[1]["refresh_sec"], 30)
+        fetch()
+        get_mock.assert_called_once_with(stop_id="1", now=None)
+        self.assertEqual(render([]), "")
@@ -1,27 +1,31 @@
+from datetime import datetime
 from unittest import TestCase
 from unittest.mock import Mock, patch
 
 from webtest import TestApp
 
 import ruterstop
+from ruterstop.utils import FakeClock
+
+NOW = datetime(2021, 5, 10, 8, 0, 0)
 
 
 class WebAppTestCase(TestCase):
     def setUp(self):
         self.app = TestApp(ruterstop.webapp)
-        pass
+        self.clock = FakeClock(NOW).__enter__()
 
     def tearDown(self):
+        self.clock.__exit__()
         self.app.reset()
-        pass
 
     @patch("ruterstop.format_departure_list", return_value=None)
     @patch("ruterstop.get_departures", return_value=dict(a="foo"))
     def test_calls_api_on_proper_path(self, get_mock, format_mock):
         res = self.app.get("/1234")
         self.assertEqual(res.content_type, "text/plain")
-        get_mock.assert_called_once_with(stop_id=1234)
-        format_mock.assert_called_once_with(dict(a="foo"))
+        get_mock.assert_called_once_with(stop_id=1234, now=NOW)
+        format_mock.assert_called_once_with(dict(a="foo"), now=NOW)
 
     @patch("ruterstop.get_departures", return_value=None)
     def test_simple_404_error(self, mock):
@@ -48,7 +52,26 @@ class WebAppTestCase(TestCase):
     @patch("ruterstop.get_departures", return_value=dict(a="foo"))
     def test_calls_api_with_querystring_params(self, get_mock, format_mock):
         self.app.get("/1234?direction=inbound&min_eta=5&bogusargs=1337")
-        get_mock.assert_called_once_with(stop_id=1234)
+        get_mock.assert_called_once_with(stop_id=1234, now=NOW)
         format_mock.assert_called_once_with(
-            dict(a="foo"), directions="inbound", min_eta=5
+            dict(a="foo"), directions="inbound", min_eta=5, now=NOW
         )
+
+    @patch("ruterstop.format_departure_list", return_value="")
+    @patch("ruterstop.get_merged_departures", return_value=dict(a="foo"))
+    def test_merges_comma_separated_stops(self, get_mock, format_mock):
+        res = self.app.get("/6013,6014?grouped=1")
+        self.assertEqual(res.content_type, "text/plain")
+        get_mock.assert_called_once_with(stop_ids=[6013, 6014], now=NOW)
+        format_mock.assert_called_once_with(dict(a="foo"), grouped=True, now=NOW)
+
+    @patch("ruterstop.get_merged_departures", return_value=[])
+    def test_rejects_too_many_stops(self, mock):
+        path = "/" + ",".join(str(i) for i in range(11))
+        res = self.app.get(path, expect_errors=True)
+        self.assertEqual(res.status_code, 400)
+        self.assertEqual(res.content_type, "text/plain")
+        self.assertEqual(mock.call_count, 0)
+
+        res = self.app.get("/6013,", expect_errors=True)
+        self.assertEqual(res.status_code, 404)
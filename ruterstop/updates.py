@@ -0,0 +1,144 @@
+"""
+Delta updates of departure boards for polling clients, served at
+`/<stop_id>/delta?since=<version>`.
+
+The server keeps the last few versions of each stop's departure list. A
+client sends the version it last saw, and gets back only the departures
+that were added, removed or had their ETA changed since then. Clients
+without a version, or with one that is too old, get a full snapshot.
+
+Responses are plain text, one record per line, to be cheap to parse on
+microcontrollers. The first line is the version, the server time as a Unix
+timestamp, and `full` or `delta`. Then follows one line per change:
+
+    1620630000123 1620629970 delta
+    + 5d1c0e3a 1620630300 1 outbound 31 Snaroeya
+    ~ 9b0f2e71 1620630420 1
+    - 0c4a61f2
+
+`+` adds a departure with its ETA as a Unix timestamp, whether the ETA is
+realtime, its direction, line and destination. `~` gives a new ETA and
+realtime flag for a departure the client already has, and `-` removes one.
+In a full snapshot every departure is an `+` line, and the client should
+drop everything it had.
+"""
+
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from ruterstop import utils
+
+# Versions kept per stop. Clients further behind get a full snapshot.
+HISTORY = 16
+
+
+def departure_key(dep):
+    """
+    Return a short key identifying a departure between versions. Departures
+    without a service journey ID are identified by their line, direction,
+    destination and ETA, so an ETA change is seen as a removal and an addition.
+    """
+    ident = dep.id or "{}|{}|{}|{:%Y%m%d%H%M%S}".format(
+        dep.line, dep.direction, dep.name, dep.eta
+    )
+    return "{:08x}".format(zlib.crc32(ident.encode()))
+
+
+def timestamp(dt):
+    """Unix timestamp of a naive local time"""
+    return int(time.mktime(dt.timetuple()))
+
+
+class DeltaLog:
+    """
+    The recent versions of one stop's departure list. Versions are
+    milliseconds since the epoch at the time they were recorded, so they
+    increase across server restarts too.
+    """
+
+    def __init__(self, *, history=HISTORY, clock=None):
+        self.history = history
+        self.clock = clock or (lambda: utils.now().timestamp())
+        self.versions = OrderedDict()
+        self.lock = threading.Lock()
+
+    @property
+    def version(self):
+        return next(reversed(self.versions)) if self.versions else None
+
+    def update(self, departures):
+        """
+        Record `departures` as a new version if they differ from the latest
+        one, and return the latest version.
+        """
+        snapshot = OrderedDict((departure_key(d), d) for d in departures)
+        with self.lock:
+            latest = self.version
+            if latest is not None and self.versions[latest] == snapshot:
+                return latest
+
+            version = int(self.clock() * 1000)
+            if latest is not None and version <= latest:
+                version = latest + 1
+            self.versions[version] = snapshot
+            while len(self.versions) > self.history:
+                self.versions.popitem(last=False)
+            return version
+
+    def changes(self, since, *, directions=None):
+        """
+        Return `(version, full, changes)` where `changes` is a list of
+        `(op, key, departure)` tuples leading from version `since` to the
+        latest one. `full` is True when `since` is unknown, and the changes
+        are then the whole latest version.
+        """
+        with self.lock:
+            version = self.version
+            current = self.versions[version]
+            old = self.versions.get(since)
+
+        def wanted(dep):
+            return not directions or dep.direction in directions
+
+        if old is None:
+            return version, True, [("+", k, d) for k, d in current.items() if wanted(d)]
+
+        changes = []
+        for key, dep in old.items():
+            if key not in current and wanted(dep):
+                changes.append(("-", key, dep))
+        for key, dep in current.items():
+            if not wanted(dep):
+                continue
+            if key not in old:
+                changes.append(("+", key, dep))
+            elif (old[key].eta, old[key].realtime) != (dep.eta, dep.realtime):
+                changes.append(("~", key, dep))
+        return version, False, changes
+
+
+def format_delta(version, full, changes, *, now=None):
+    """Format the result of DeltaLog.changes as a response body"""
+    now = now or utils.now()
+    lines = ["{} {} {}".format(version, timestamp(now), "full" if full else "delta")]
+    for op, key, dep in changes:
+        if op == "+":
+            lines.append(
+                "+ {} {} {:d} {} {} {}".format(
+                    key,
+                    timestamp(dep.eta),
+                    bool(dep.realtime),
+                    dep.direction,
+                    dep.line,
+                    dep.name,
+                ).rstrip()
+            )
+        elif op == "~":
+            lines.append(
+                "~ {} {} {:d}".format(key, timestamp(dep.eta), bool(dep.realtime))
+            )
+        else:
+            lines.append("- " + key)
+    return "\n".join(lines) + "\n"
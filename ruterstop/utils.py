@@ -1,9 +1,85 @@
 import re
+import threading
+import time
 
 from datetime import datetime, timedelta
 from functools import wraps, _make_key
 
 
+class SystemClock:
+    """
+    The real time. `now()` is the local wall-clock time, used for ETAs, and
+    `monotonic()` counts seconds that never jump, used for expiry.
+    """
+
+    @staticmethod
+    def now():
+        return datetime.now()
+
+    @staticmethod
+    def monotonic():
+        return time.monotonic()
+
+
+class FakeClock:
+    """
+    A clock that stands still until it is moved. Use it as a context manager
+    to make it the package's clock, e.g. in tests:
+
+        with FakeClock(datetime(2021, 5, 10, 8, 0)) as clock:
+            ...
+            clock.advance(seconds=30)
+    """
+
+    def __init__(self, now=datetime(2000, 1, 1)):
+        self._now = now
+        self._monotonic = 0.0
+        self._previous = None
+
+    def now(self):
+        return self._now
+
+    def monotonic(self):
+        return self._monotonic
+
+    def advance(self, **kwargs):
+        """Move both clocks forward by `timedelta(**kwargs)`"""
+        step = timedelta(**kwargs)
+        self._now += step
+        self._monotonic += step.total_seconds()
+
+    def set(self, now):
+        """Set the wall-clock time only, like when the system clock is adjusted"""
+        self._now = now
+
+    def __enter__(self):
+        self._previous = set_clock(self)
+        return self
+
+    def __exit__(self, *_):
+        set_clock(self._previous)
+
+
+_clock = SystemClock()
+
+
+def set_clock(clock):
+    """Make `clock` the source of time for the package. Returns the previous one."""
+    global _clock  # pylint: disable=global-statement
+    previous, _clock = _clock, clock
+    return previous
+
+
+def now():
+    """Return the current wall-clock time of the package's clock"""
+    return _clock.now()
+
+
+def monotonic():
+    """Return the current monotonic time of the package's clock, in seconds"""
+    return _clock.monotonic()
+
+
 def norwegian_ascii(unicode_str):
     """
     Return an ASCII string with Norwegian chars replaced with their closest
@@ -15,28 +91,68 @@ def norwegian_ascii(unicode_str):
     return unicode_str.encode("ascii", "ignore").decode()
 
 
-def timed_cache(*, expires_sec=60, now=datetime.now):
+def timed_cache(*, expires_sec=60, clock=None):
     """
     Decorator function to cache function calls with same signature for a set
     amount of time.
 
+    Expiry is measured with the monotonic time of `clock`, or of the
+    package's clock (see `set_clock`), so adjusting the system clock doesn't
+    expire entries early or keep them too long.
+
+    Concurrent calls that miss the cache for the same key wait for one of
+    them to call the function, instead of all calling it.
+
     It does not delete any keys from the cache, so it might grow indefinitely.
+    Call `cache_clear()` on the decorated function to empty it.
+
+    `cache_peek(*args, **kwargs)` returns the cached `(value, age)` for a
+    call, with the age in seconds, or None, without calling the function.
+    `cache_prime(value, age, *args, **kwargs)` stores a value as if the call
+    was made `age` seconds ago.
     """
     cache = {}
+    locks = {}
+    locks_lock = threading.Lock()
+
+    def current_time():
+        return (clock or _clock).monotonic()
+
+    def fresh(entry, current):
+        return entry is not None and current <= entry["fetched"] + expires_sec
 
     def decorator(func):
         @wraps(func)
         def wrapper(*_args, **_kwargs):
-            time = now()
             key = _make_key(_args, _kwargs, False)  # pylint: disable=protected-access
-
-            if key not in cache or time > cache[key]["timestamp"] + timedelta(
-                seconds=expires_sec
-            ):
-                cache[key] = dict(value=func(*_args, **_kwargs), timestamp=time)
-
-            return cache[key]["value"]
-
+            entry = cache.get(key)
+            if fresh(entry, current_time()):
+                return entry["value"]
+
+            with locks_lock:
+                lock = locks.setdefault(key, threading.Lock())
+            with lock:
+                # Another thread may have filled it while this one waited
+                entry = cache.get(key)
+                current = current_time()
+                if not fresh(entry, current):
+                    entry = dict(value=func(*_args, **_kwargs), fetched=current)
+                    cache[key] = entry
+            return entry["value"]
+
+        def cache_peek(*_args, **_kwargs):
+            entry = cache.get(_make_key(_args, _kwargs, False))
+            if entry is None:
+                return None
+            return entry["value"], current_time() - entry["fetched"]
+
+        def cache_prime(value, age, *_args, **_kwargs):
+            key = _make_key(_args, _kwargs, False)
+            cache[key] = dict(value=value, fetched=current_time() - age)
+
+        wrapper.cache_clear = cache.clear
+        wrapper.cache_peek = cache_peek
+        wrapper.cache_prime = cache_prime
         return wrapper
 
     return decorator
@@ -48,7 +164,7 @@ def delta(until=None, *, since=None):
     Returns -1 if `since` is later than `until`.
     """
     if not since:
-        since = datetime.now()
+        since = now()
 
     if since > until:
         return -1
@@ -70,10 +186,24 @@ def human_delta(until=None, *, since=None):
     """
     now_str = "{:>6}".format("naa")
 
-    since = since if since else datetime.now()
+    since = since if since else now()
     mins = min(delta(until, since=since), 99)
 
     if mins < 1:
         return now_str
 
     return "{:2} min".format(mins)
+
+
+def seconds_until_change(departures, now=None):
+    """
+    Return seconds until the ETA of any departure rolls over to the next
+    whole minute, or None if no ETA will change.
+    """
+    now = now or _clock.now()
+    waits = []
+    for dep in departures:
+        secs = (dep.eta - now).total_seconds()
+        if secs >= 0:
+            waits.append(secs % 60 or 60)
+    return min(waits) if waits else None
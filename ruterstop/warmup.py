@@ -0,0 +1,190 @@
+"""
+Cache warmup for `--server` mode.
+
+The server counts requests per stop and hour of day. With a state file, the
+counts and the last fetched payload of the most popular stops are saved on
+shutdown, and on startup:
+
+- payloads still younger than the cache lifetime are put back in the cache
+  with their original fetch times, so they expire at different moments
+- the rest of the hot set for the current hour is fetched one stop at a time,
+  paced so the upstream API doesn't see a burst
+
+Pre-warming can also be scheduled at fixed times of day, before the peak
+hours of the displays using the server.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+from ruterstop import utils
+
+log = logging.getLogger("ruterstop")
+
+STATE_VERSION = 1
+
+# Most stops warmed at once, and the pause between their fetches
+HOT_STOPS = 50
+WARMUP_INTERVAL_SEC = 0.2
+
+
+class Popularity:
+    """Request counts per stop for each hour of the day"""
+
+    def __init__(self, hours=None):
+        self.hours = hours or [Counter() for _ in range(24)]
+        self.lock = threading.Lock()
+
+    def record(self, stop_id, *, when=None):
+        hour = (when or utils.now()).hour
+        with self.lock:
+            self.hours[hour][stop_id] += 1
+
+    def hot(self, hour, *, limit=HOT_STOPS):
+        """
+        Return the most requested stops in `hour`, most popular first, or the
+        most requested stops overall if nothing was requested in that hour.
+        """
+        with self.lock:
+            counts = self.hours[hour]
+            if not counts:
+                counts = sum(self.hours, Counter())
+            return [stop_id for stop_id, _ in counts.most_common(limit)]
+
+    def to_list(self):
+        with self.lock:
+            return [sorted(c.items()) for c in self.hours]
+
+    @classmethod
+    def from_list(cls, hours):
+        return cls([Counter(dict(map(tuple, h))) for h in hours])
+
+
+def save_state(path, *, popularity, payloads):
+    """
+    Write the popularity counts and `payloads`, a list of (stop_id, payload,
+    fetched) tuples, to `path` atomically.
+    """
+    state = dict(
+        version=STATE_VERSION,
+        popularity=popularity.to_list(),
+        payloads=[
+            dict(stop_id=stop_id, fetched=fetched.timestamp(), payload=payload)
+            for stop_id, payload, fetched in payloads
+        ],
+    )
+    tmp = path + ".tmp"
+    with open(tmp, "w") as fp:
+        json.dump(state, fp, separators=(",", ":"))
+    os.replace(tmp, path)
+
+
+def load_state(path):
+    """
+    Return the popularity and payloads saved in `path`, or empty ones if it
+    is missing or unreadable.
+    """
+    try:
+        with open(path) as fp:
+            state = json.load(fp)
+        if state.get("version") != STATE_VERSION:
+            raise ValueError("unsupported version")
+        popularity = Popularity.from_list(state["popularity"])
+        payloads = [
+            (p["stop_id"], p["payload"], datetime.fromtimestamp(p["fetched"]))
+            for p in state["payloads"]
+        ]
+    except FileNotFoundError:
+        return Popularity(), []
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        log.warning("Ignoring warmup state in %s: %s", path, e)
+        return Popularity(), []
+    return popularity, payloads
+
+
+def parse_times(spec):
+    """Parse a comma separated list of HH:MM times of day"""
+    times = []
+    for t in spec.split(","):
+        try:
+            times.append(datetime.strptime(t.strip(), "%H:%M").time())
+        except ValueError:
+            raise ValueError("invalid time of day: " + t)
+    return sorted(times)
+
+
+def next_occurrence(times, now):
+    """Return the first datetime after `now` at one of the `times` of day"""
+    for day in range(2):
+        date = now.date() + timedelta(days=day)
+        for t in times:
+            when = datetime.combine(date, t)
+            if when > now:
+                return when
+    return None
+
+
+class Warmer:
+    """
+    Fetches the hot set of stops, one at a time with `interval` seconds in
+    between. `fetch` is called with a stop ID and should fill the cache.
+    """
+
+    def __init__(
+        self,
+        fetch,
+        *,
+        popularity,
+        interval=WARMUP_INTERVAL_SEC,
+        limit=HOT_STOPS,
+        sleep=time.sleep,
+        now=utils.now,
+    ):
+        self.fetch = fetch
+        self.popularity = popularity
+        self.interval = interval
+        self.limit = limit
+        self.sleep = sleep
+        self.now = now
+
+    def warm(self, stop_ids, *, interval=None):
+        """Fetch each of `stop_ids`, and return the number of successful fetches"""
+        interval = self.interval if interval is None else interval
+        done = 0
+        for i, stop_id in enumerate(stop_ids):
+            if i:
+                self.sleep(interval)
+            try:
+                self.fetch(stop_id)
+                done += 1
+            except Exception as e:  # pylint: disable=broad-except
+                log.warning("Warming stop %s failed: %s", stop_id, e)
+        log.info("Warmed %d of %d stops", done, len(stop_ids))
+        return done
+
+    def warm_hot(self, *, skip=(), hour=None, interval=None):
+        hour = self.now().hour if hour is None else hour
+        stop_ids = self.popularity.hot(hour, limit=self.limit)
+        return self.warm([s for s in stop_ids if s not in skip], interval=interval)
+
+    def run_schedule(self, times, *, lead_sec):
+        """
+        Warm the hot set of each scheduled hour, spread over the `lead_sec`
+        seconds before each of the `times` of day. Runs forever.
+        """
+        while True:
+            when = next_occurrence(times, self.now())
+            wait = (when - self.now()).total_seconds() - lead_sec
+            if wait > 0:
+                self.sleep(wait)
+            count = len(self.popularity.hot(when.hour, limit=self.limit))
+            self.warm_hot(hour=when.hour, interval=lead_sec / max(count, 1))
+            # Don't warm the same occurrence twice
+            rest = (when - self.now()).total_seconds()
+            if rest > 0:
+                self.sleep(rest)
@@ -0,0 +1,99 @@
+"""
+Live departure board for `--watch` mode.
+
+Keeps one process and HTTP session running, fetches new data when the cache
+expires, and in between only re-renders when a departure's ETA rolls over to
+the next whole minute. Only the terminal lines that changed are redrawn.
+"""
+
+import logging
+import time
+
+from ruterstop import utils
+from ruterstop.utils import seconds_until_change
+
+log = logging.getLogger("ruterstop")
+
+CLEAR_SCREEN = "\x1b[2J"
+CLEAR_LINE = "\x1b[K"
+HIDE_CURSOR = "\x1b[?25l"
+SHOW_CURSOR = "\x1b[?25h"
+
+
+def move_to(row):
+    return "\x1b[{};1H".format(row)
+
+
+class TerminalBoard:
+    """Draws frames of text, rewriting only the lines that changed"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lines = None
+
+    def draw(self, text):
+        lines = text.rstrip("\n").split("\n") if text.strip() else []
+        out = []
+        if self.lines is None:
+            out.append(HIDE_CURSOR + CLEAR_SCREEN)
+            self.lines = []
+
+        for i, line in enumerate(lines):
+            if i >= len(self.lines) or self.lines[i] != line:
+                out.append(move_to(i + 1) + line + CLEAR_LINE)
+        for i in range(len(lines), len(self.lines)):
+            out.append(move_to(i + 1) + CLEAR_LINE)
+
+        self.lines = lines
+        if out:
+            self.stream.write("".join(out))
+            self.stream.flush()
+        return len(out)
+
+    def close(self):
+        """Leave the cursor below the board"""
+        self.stream.write(move_to(len(self.lines or []) + 1) + SHOW_CURSOR)
+        self.stream.flush()
+
+
+def watch(
+    fetch,
+    render,
+    *,
+    stream,
+    refresh_sec,
+    clock=utils.monotonic,
+    sleep=time.sleep,
+    now=utils.now,
+):
+    """
+    Show `render(departures)` in the terminal until interrupted, calling
+    `fetch()` for new departures every `refresh_sec` seconds.
+
+    If a fetch fails, the previous departures are kept and retried on the
+    next refresh.
+    """
+    board = TerminalBoard(stream)
+    departures = []
+    next_fetch = clock()
+    try:
+        while True:
+            if clock() >= next_fetch:
+                try:
+                    departures = list(fetch())
+                except Exception as e:  # pylint: disable=broad-except
+                    log.warning("Could not refresh departures: %s", e)
+                next_fetch = clock() + refresh_sec
+
+            board.draw(render(departures))
+
+            wait = next_fetch - clock()
+            change = seconds_until_change(departures, now())
+            if change is not None:
+                # Wake up just after the minute has rolled over
+                wait = min(wait, change + 0.05)
+            sleep(max(wait, 0.05))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        board.close()